@@ -0,0 +1,26 @@
+// Title/author suggestions for the catalog search box (GET /autocomplete/).
+(function () {
+  var input = document.getElementById('book-search');
+  var box = document.getElementById('book-suggestions');
+  if (!input || !box) { return; }
+  var pending = null;
+  input.addEventListener('input', function () {
+    var q = input.value.trim();
+    if (pending) { pending.abort(); }
+    if (!q) { box.innerHTML = ''; return; }
+    pending = new AbortController();
+    fetch(input.dataset.url + '?q=' + encodeURIComponent(q), {signal: pending.signal})
+      .then(function (r) { return r.json(); })
+      .then(function (data) {
+        box.innerHTML = '';
+        data.results.forEach(function (b) {
+          var a = document.createElement('a');
+          a.className = 'list-group-item list-group-item-action';
+          a.href = input.dataset.detailUrl.replace('BOOK_ID', b.id);
+          a.textContent = b.title + ' — ' + b.author;
+          box.appendChild(a);
+        });
+      })
+      .catch(function () {});
+  });
+})();
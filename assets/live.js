@@ -0,0 +1,21 @@
+// Patch availability counts in place from the live updates stream
+// (GET /live/availability/, see library/live.py).
+(function () {
+  var url = document.body.dataset.liveUrl;
+  var nodes = document.querySelectorAll('[data-live-book]');
+  if (!url || !nodes.length || !window.EventSource) { return; }
+  var ids = [];
+  nodes.forEach(function (n) {
+    if (ids.indexOf(n.dataset.liveBook) < 0) { ids.push(n.dataset.liveBook); }
+  });
+  var source = new EventSource(url + '?books=' + ids.join(','));
+  source.addEventListener('availability', function (e) {
+    var changes = JSON.parse(e.data);
+    nodes.forEach(function (n) {
+      var c = changes[n.dataset.liveBook];
+      if (!c) { return; }
+      n.querySelector('.live-available').textContent = c.available;
+      n.querySelector('.live-total').textContent = c.total;
+    });
+  });
+})();
@@ -0,0 +1,89 @@
+"""Bundling and minification of the app's own CSS and JavaScript.
+
+Sources live in `ASSETS_SOURCE_DIR` (the top-level `assets/` directory).
+`build()` concatenates each bundle in `BUNDLES` and writes one minified
+file per bundle into the first `STATICFILES_DIRS` entry. From there
+`collectstatic` fingerprints it and precompresses it with gzip and
+brotli (`CompressedManifestStaticFilesStorage`), so a page loads one
+stylesheet and one script. Both can be cached as immutable.
+
+rjsmin/rcssmin are used when installed. Otherwise a conservative
+built-in pass drops comments, indentation and blank lines. That pass
+is safe for these sources, which keep comments on lines of their own.
+"""
+import re
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    from rjsmin import jsmin as _jsmin
+except Exception:
+    # rjsmin is optional; fall back to the line-based pass below.
+    _jsmin = None
+
+try:
+    from rcssmin import cssmin as _cssmin
+except Exception:
+    _cssmin = None
+
+# output file (relative to the static dir) -> source files, in order
+BUNDLES = {
+    'library/app.min.css': ['app.css'],
+    'library/app.min.js': ['autocomplete.js', 'live.js'],
+}
+
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACE = re.compile(r'\s+')
+_CSS_PUNCT = re.compile(r'\s*([{}:;,>])\s*')
+
+
+def source_dir():
+    return Path(getattr(settings, 'ASSETS_SOURCE_DIR', Path(settings.BASE_DIR) / 'assets'))
+
+
+def output_dir():
+    return Path(settings.STATICFILES_DIRS[0])
+
+
+def minify_js(text):
+    if _jsmin is not None:
+        return _jsmin(text)
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    # keep line breaks so automatic semicolon insertion still applies
+    return '\n'.join(lines) + '\n'
+
+
+def minify_css(text):
+    if _cssmin is not None:
+        return _cssmin(text)
+    text = _CSS_COMMENT.sub('', text)
+    text = _CSS_SPACE.sub(' ', text)
+    text = _CSS_PUNCT.sub(r'\1', text)
+    return text.replace(';}', '}').strip() + '\n'
+
+
+def bundle(name):
+    """Return the minified contents of bundle `name`."""
+    parts = [(source_dir() / src).read_text(encoding='utf-8') for src in BUNDLES[name]]
+    if name.endswith('.js'):
+        # each source is a self-contained IIFE; the semicolon guards the join
+        return minify_js(';\n'.join(parts))
+    return minify_css('\n'.join(parts))
+
+
+def build():
+    """Write every bundle; returns `[(name, source_bytes, output_bytes)]`."""
+    written = []
+    for name, sources in BUNDLES.items():
+        content = bundle(name)
+        path = output_dir() / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding='utf-8')
+        source_bytes = sum((source_dir() / src).stat().st_size for src in sources)
+        written.append((name, source_bytes, len(content.encode('utf-8'))))
+    return written
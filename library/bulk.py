@@ -0,0 +1,96 @@
+"""Bulk staff operations: returning many loans and editing many books.
+
+Both run in one request with a fixed number of round trips, whatever the
+selection size:
+
+- `return_records` closes the selected loans with one `update_many`,
+  tagging them with a batch token, then frees exactly the number of each
+  book's loans that batch closed (one aggregation plus one `bulk_write`;
+  copies of books with a waitlist go to reservations instead, see
+  `library.reservations`). Loans returned concurrently by someone else
+  are not tagged and so never counted twice.
+- `update_books` sets the genre and/or adjusts `total_copies` with one
+  `bulk_write`. A copy change that would leave fewer copies than are on
+  loan or on hold is refused per book, so availability never goes
+  negative. Added copies go to waiting reservations first.
+"""
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+from . import mongo_models
+from . import reservations
+
+
+def _object_ids(values):
+    ids = []
+    for value in values:
+        try:
+            ids.append(ObjectId(value))
+        except (InvalidId, TypeError):
+            continue
+    return ids
+
+
+def return_records(record_ids, user=None):
+    """Mark the selected open loans returned.
+
+    When `user` is given and is not staff, only that user's own loans are
+    touched. Returns a dict with `returned` and `book_ids` (the books whose
+    availability changed).
+    """
+    ids = _object_ids(record_ids)
+    if not ids:
+        return {'returned': 0, 'book_ids': []}
+    coll = mongo_models.BorrowRecord._get_collection()
+    token = ObjectId()
+    query = {'_id': {'$in': ids}, 'returned': False}
+    if user is not None and not user.is_staff:
+        query['user_id'] = user.id
+    result = coll.update_many(query, {'$set': {
+        'returned': True,
+        'return_date': datetime.now(timezone.utc),
+        'return_batch': token,
+    }})
+    if not result.modified_count:
+        return {'returned': 0, 'book_ids': []}
+
+    per_book = {row['_id']: row['n'] for row in coll.aggregate([
+        {'$match': {'return_batch': token}},
+        {'$group': {'_id': '$book_id', 'n': {'$sum': 1}}},
+    ])}
+    reservations.release_many(per_book)
+    return {'returned': result.modified_count, 'book_ids': list(per_book)}
+
+
+def update_books(book_ids, genre=None, copies_delta=0):
+    """Apply a genre and/or total_copies change to the selected books.
+
+    Returns a dict with `updated` and `skipped` counts; books are skipped
+    when the copy change would drop below zero or below their active loans
+    and holds.
+    """
+    ids = _object_ids(book_ids)
+    if not ids or (genre is None and not copies_delta):
+        return {'updated': 0, 'skipped': len(ids)}
+
+    update = {'$set': {'updated_at': datetime.now(timezone.utc)}}
+    if genre is not None:
+        update['$set']['genre'] = genre
+    condition = {}
+    if copies_delta:
+        update['$inc'] = {'total_copies': copies_delta}
+        condition = {'$expr': {'$gte': [
+            {'$add': ['$total_copies', copies_delta]},
+            {'$max': [0, {'$add': [{'$ifNull': ['$active_borrows', 0]}, {'$ifNull': ['$held_copies', 0]}]}]},
+        ]}}
+
+    result = mongo_models.Book._get_collection().bulk_write(
+        [UpdateOne({'_id': book_id, **condition}, update) for book_id in ids],
+        ordered=False,
+    )
+    if copies_delta > 0:
+        reservations.promote_waiting(ids)
+    return {'updated': result.matched_count, 'skipped': len(ids) - result.matched_count}
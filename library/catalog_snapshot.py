@@ -0,0 +1,323 @@
+"""On-disk snapshot of the book catalog with availability.
+
+The catalog pages used to query MongoDB on every request and showed an
+empty catalog (or a 404) whenever MongoDB was unreachable. This module
+keeps a small SQLite copy of every book together with its available
+copies so that:
+
+- `home` and `book_detail` can be served read-only from the snapshot
+  while MongoDB is down, clearly marked as stale (pages are read with
+  LIMIT/OFFSET, so the cost does not grow with the catalog);
+- new workers start warm: while a worker's facet cache has no entry for
+  an unfiltered catalog page, `home` serves it from the snapshot (when
+  fresh) and fills the cache in the background;
+- refreshes are incremental: only books edited, borrowed or returned
+  since the last refresh are re-read from MongoDB.
+
+The snapshot file is shared by every worker on the machine (SQLite in WAL
+mode allows concurrent readers while one writer refreshes it). Refreshes
+happen in the background when a page notices the snapshot is older than
+`CATALOG_SNAPSHOT_MAX_AGE`, or periodically via the
+`refresh_catalog_snapshot` management command.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from django.conf import settings
+from pymongo.errors import PyMongoError
+
+from . import mongo_models
+from . import mongo_status
+
+try:
+    from mongoengine.queryset.visitor import Q
+except Exception:
+    Q = None
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    genre TEXT,
+    total_copies INTEGER NOT NULL,
+    available_copies INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Re-read changes slightly older than the last watermark so writes that
+# were in flight while the previous refresh ran are not missed. Upserts are
+# idempotent, so the overlap only costs a few duplicate rows.
+_WATERMARK_OVERLAP = timedelta(seconds=5)
+
+# Rows written per executemany() call during a full refresh.
+_BATCH_SIZE = 1000
+
+_refresh_lock = threading.Lock()
+
+# Deleted books not yet dropped from the snapshot (it was locked or not
+# writable); the next refresh in this process drops them.
+_pending_forget = set()
+
+
+class SnapshotBook:
+    """Read-only stand-in for `mongo_models.Book` built from a snapshot row.
+
+    Exposes the attributes the catalog templates use (`pk`, `title`,
+    `available_copies`, ...) so templates work unchanged.
+    """
+
+    __slots__ = ('id', 'title', 'author', 'genre', 'total_copies', 'available_copies')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.title = row['title']
+        self.author = row['author']
+        self.genre = row['genre']
+        self.total_copies = row['total_copies']
+        self.available_copies = row['available_copies']
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def borrowed_count(self):
+        return max(0, self.total_copies - self.available_copies)
+
+    def __str__(self):
+        return f"{self.title} by {self.author}"
+
+
+def _snapshot_path():
+    default = Path(settings.BASE_DIR) / 'catalog_snapshot.sqlite3'
+    return Path(getattr(settings, 'CATALOG_SNAPSHOT_PATH', default))
+
+
+def _max_age():
+    return getattr(settings, 'CATALOG_SNAPSHOT_MAX_AGE', 30)
+
+
+def _connect():
+    conn = sqlite3.connect(str(_snapshot_path()), timeout=5, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(_SCHEMA)
+    conn.execute('CREATE INDEX IF NOT EXISTS books_title ON books (title, id)')
+    return conn
+
+
+def _get_meta(conn, key):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row['value'] if row else None
+
+
+def _set_meta(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+
+def _refreshed_at(conn):
+    value = _get_meta(conn, 'refreshed_at')
+    return datetime.fromisoformat(value) if value else None
+
+
+def refreshed_at():
+    """When the snapshot was last refreshed (aware UTC), or None."""
+    conn = _connect()
+    try:
+        return _refreshed_at(conn)
+    finally:
+        conn.close()
+
+
+def load_page(offset, limit):
+    """Return `(books, total, refreshed_at)` for one page of the snapshot.
+
+    Only the requested rows are read (LIMIT/OFFSET over the primary key
+    order), so the cost does not grow with the catalog.
+    """
+    conn = _connect()
+    try:
+        refreshed_at = _refreshed_at(conn)
+        if refreshed_at is None:
+            return [], 0, None
+        total = conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+        rows = conn.execute('SELECT * FROM books ORDER BY title, id LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+        return [SnapshotBook(r) for r in rows], total, refreshed_at
+    finally:
+        conn.close()
+
+
+def load_book(pk):
+    """Return `(book, refreshed_at)` for one book; `book` is None if absent."""
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT * FROM books WHERE id = ?', (str(pk),)).fetchone()
+        return (SnapshotBook(row) if row else None), _refreshed_at(conn)
+    finally:
+        conn.close()
+
+
+def is_expired(refreshed_at):
+    """True when a snapshot taken at `refreshed_at` should be revalidated."""
+    if refreshed_at is None:
+        return True
+    age = (datetime.now(timezone.utc) - refreshed_at).total_seconds()
+    return age > _max_age()
+
+
+def forget_book(book_id):
+    """Drop a deleted book from the snapshot immediately.
+
+    Incremental refreshes only see books that still exist, so deletes are
+    applied directly by the view that performs them. Never raises: when
+    the snapshot is locked by a long refresh or cannot be written, the id
+    is remembered and dropped by the next refresh in this process.
+    """
+    _pending_forget.add(str(book_id))
+    try:
+        conn = _connect()
+        try:
+            conn.execute('DELETE FROM books WHERE id = ?', (str(book_id),))
+        finally:
+            conn.close()
+    except Exception:
+        logger.warning('Could not drop book %s from the catalog snapshot; retrying on the next refresh', book_id, exc_info=True)
+        return
+    _pending_forget.discard(str(book_id))
+
+
+def _borrowed_counts(book_ids=None):
+    """Map book ObjectId -> number of active borrows, in one aggregation."""
+    qs = mongo_models.BorrowRecord.objects(returned=False)
+    if book_ids is not None:
+        qs = qs.filter(book_id__in=list(book_ids))
+    pipeline = [{'$group': {'_id': '$book_id', 'n': {'$sum': 1}}}]
+    return {row['_id']: row['n'] for row in qs.aggregate(pipeline)}
+
+
+def _changed_book_ids(since):
+    """Ids of books edited, borrowed, returned or with holds changed after `since`."""
+    ids = set(mongo_models.Book.objects(updated_at__gt=since).scalar('id'))
+    changed_borrows = mongo_models.BorrowRecord.objects(Q(borrow_date__gt=since) | Q(return_date__gt=since))
+    ids.update(changed_borrows.distinct('book_id'))
+    changed_holds = mongo_models.Reservation.objects(Q(held_at__gt=since) | Q(closed_at__gt=since))
+    ids.update(changed_holds.distinct('book_id'))
+    return ids
+
+
+def _rows(docs, borrowed):
+    for d in docs:
+        total = d.get('total_copies') or 0
+        yield (
+            str(d['_id']),
+            d.get('title') or '',
+            d.get('author') or '',
+            d.get('genre') or '',
+            total,
+            max(0, total - borrowed.get(d['_id'], 0) - (d.get('held_copies') or 0)),
+        )
+
+
+def _write_batches(conn, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= _BATCH_SIZE:
+            conn.executemany('INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?)', batch)
+
+
+def refresh(full=False):
+    """Bring the snapshot up to date with MongoDB.
+
+    Without `full`, only books changed since the previous refresh are
+    re-read; the first refresh (or `full=True`) rewrites every row.
+    Returns a dict with `full`, `updated` and `removed` counts.
+    """
+    started = datetime.now(timezone.utc)
+    fields = ('id', 'title', 'author', 'genre', 'total_copies', 'held_copies')
+    conn = _connect()
+    try:
+        watermark = None if full else _get_meta(conn, 'watermark')
+        if watermark is None:
+            full = True
+            docs = mongo_models.Book.objects.only(*fields).as_pymongo()
+            borrowed = _borrowed_counts()
+            wanted = None
+        else:
+            since = datetime.fromisoformat(watermark) - _WATERMARK_OVERLAP
+            wanted = _changed_book_ids(since)
+            docs = list(mongo_models.Book.objects(id__in=list(wanted)).only(*fields).as_pymongo()) if wanted else []
+            borrowed = _borrowed_counts(wanted) if wanted else {}
+
+        seen = set()
+
+        def tracked(rows):
+            for row in rows:
+                seen.add(row[0])
+                yield row
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if full:
+                conn.execute('DELETE FROM books')
+            _write_batches(conn, tracked(_rows(docs, borrowed)))
+            removed = 0
+            if wanted:
+                # changed ids that no longer resolve to a book were deleted
+                gone = [(str(i),) for i in wanted if str(i) not in seen]
+                conn.executemany('DELETE FROM books WHERE id = ?', gone)
+                removed = len(gone)
+            forgotten = set(_pending_forget)
+            conn.executemany('DELETE FROM books WHERE id = ?', [(i,) for i in forgotten])
+            _set_meta(conn, 'watermark', started.isoformat())
+            _set_meta(conn, 'refreshed_at', datetime.now(timezone.utc).isoformat())
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        _pending_forget.difference_update(forgotten)
+        return {'full': full, 'updated': len(seen), 'removed': removed}
+    finally:
+        conn.close()
+
+
+def refresh_in_background():
+    """Start an incremental refresh in a daemon thread.
+
+    Returns False without starting anything when a refresh is already
+    running in this process, so a burst of requests triggers one refresh.
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            started = time.monotonic()
+            result = refresh()
+            logger.debug('catalog snapshot refreshed in %.3fs: %s', time.monotonic() - started, result)
+        except PyMongoError as e:
+            # the pages keep serving the (stale) snapshot; stop trying
+            # MongoDB on every request until the breaker resets
+            mongo_status.record_failure(e)
+            logger.exception('catalog snapshot refresh failed')
+        except Exception:
+            logger.exception('catalog snapshot refresh failed')
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name='catalog-snapshot-refresh', daemon=True).start()
+    return True
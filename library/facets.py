@@ -0,0 +1,335 @@
+"""Faceted catalog browsing by genre, author and availability.
+
+One `$facet` aggregation over `books` returns the requested page of
+results together with the genre and author facet counts (each with how
+many of those books are available) and the number of available books.
+Facets are disjunctive: the genre counts ignore the genre filter and the
+author counts ignore the author filter, so picking a genre still shows
+every other genre to switch to. Results, `total` and `available` apply
+every filter. Availability is read from the denormalised
+`Book.active_borrows` and `Book.held_copies` counters, so no per-book
+lookup of `borrow_records` is needed.
+
+Responses are cached in Django's cache in two entries per filter
+combination:
+
+- the listing (the page of results, `total` and the facet values with
+  their book counts), which only changes when books are added, edited or
+  deleted; `invalidate()` drops every entry;
+- the availability counts (`available` and how many books of each facet
+  value are available), shared by every page of the combination.
+  `availability_changed(book_ids)` drops them only when one of those
+  books may have gone from available to unavailable or back. They are
+  then recomputed by a smaller aggregation that reuses the listing.
+
+The copies shown for each book on the page are always read fresh, with
+one query by id. Configure a shared cache (`CACHE_URL`) so every worker
+sees invalidations at once; with the default per-process cache other
+workers see changes after `CATALOG_FACETS_TTL` seconds.
+"""
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from pymongo.errors import PyMongoError
+
+from . import live
+from . import mongo_models
+from . import mongo_status
+
+logger = logging.getLogger(__name__)
+
+# Bumped when books change; part of every key.
+_GENERATION_KEY = 'catalog-facets:generation'
+# Bumped when a book's availability may have flipped; part of the
+# availability keys and of listings filtered on availability.
+_AVAILABILITY_KEY = 'catalog-facets:availability'
+
+# Filter combinations being cached by a background thread in this process.
+_warming = set()
+_warming_lock = threading.Lock()
+
+# Values shown per facet (most common first).
+_FACET_LIMIT = 30
+
+# Copies on loan or on hold for a reservation.
+_TAKEN = {'$add': [{'$ifNull': ['$active_borrows', 0]}, {'$ifNull': ['$held_copies', 0]}]}
+
+# A book is available when it has more copies than are taken.
+_AVAILABLE = {'$gt': ['$total_copies', _TAKEN]}
+
+
+def page_size():
+    return getattr(settings, 'CATALOG_PAGE_SIZE', 60)
+
+
+def _ttl():
+    return getattr(settings, 'CATALOG_FACETS_TTL', 300)
+
+
+def _generations():
+    return cache.get_or_set(_GENERATION_KEY, 0, None), cache.get_or_set(_AVAILABILITY_KEY, 0, None)
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def invalidate():
+    """Drop every cached facet response (books were added, edited or deleted)."""
+    _bump(_GENERATION_KEY)
+
+
+def availability_changed(book_ids):
+    """Drop cached availability counts if any of `book_ids` may have flipped.
+
+    Call after borrows, returns and reservation changes. A book flips
+    between available and unavailable only while it has no free copy or
+    exactly one, so changes to books with more free copies keep the cache.
+    """
+    if not book_ids:
+        return
+    counts = live.availability(book_ids)
+    if len(counts) < len(set(map(str, book_ids))) or any(c['available'] <= 1 for c in counts.values()):
+        invalidate_availability()
+
+
+def invalidate_availability():
+    """Drop every cached availability count, keeping the listings."""
+    _bump(_AVAILABILITY_KEY)
+
+
+def _cache_key(kind, generations, *parts):
+    raw = '\x00'.join(str(p) for p in parts)
+    digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    return f'catalog-facets:{kind}:' + ':'.join(str(g) for g in generations) + f':{digest}'
+
+
+def _filters(genre, author):
+    """Return the `$match` for results and the ones for the genre and author facets.
+
+    Each facet applies every filter except its own field's.
+    """
+    by_genre = {'genre': genre} if genre else {}
+    by_author = {'author': author} if author else {}
+    return {**by_genre, **by_author}, by_author, by_genre
+
+
+def _pipeline(genre, author, available, page):
+    both, for_genres, for_authors = _filters(genre, author)
+    size = page_size()
+
+    def counts(field, match):
+        return [
+            {'$match': match},
+            {'$group': {
+                '_id': f'${field}',
+                'count': {'$sum': 1},
+                'available': {'$sum': {'$cond': [_AVAILABLE, 1, 0]}},
+            }},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$limit': _FACET_LIMIT},
+        ]
+
+    return [
+        {'$match': {'$expr': _AVAILABLE} if available else {}},
+        {'$facet': {
+            'results': [
+                {'$match': both},
+                {'$sort': {'title': 1, '_id': 1}},
+                {'$skip': (page - 1) * size},
+                {'$limit': size},
+                {'$project': {
+                    '_id': 0,
+                    'pk': {'$toString': '$_id'},
+                    'title': 1,
+                    'author': 1,
+                    'genre': 1,
+                    'total_copies': 1,
+                    'available_copies': {'$max': [0, {'$subtract': ['$total_copies', _TAKEN]}]},
+                }},
+            ],
+            'total': [{'$match': both}, {'$count': 'n'}],
+            'available': [{'$match': {**both, '$expr': _AVAILABLE}}, {'$count': 'n'}],
+            'genres': counts('genre', for_genres),
+            'authors': counts('author', for_authors),
+        }},
+    ]
+
+
+def _availability_pipeline(genre, author, available, listing):
+    """Only the availability counts, for the facet values already in `listing`."""
+    both, for_genres, for_authors = _filters(genre, author)
+
+    def counts(field, match, values):
+        return [
+            {'$match': {**match, field: {'$in': [v['value'] for v in values]}, '$expr': _AVAILABLE}},
+            {'$group': {'_id': f'${field}', 'available': {'$sum': 1}}},
+        ]
+
+    return [
+        {'$match': {'$expr': _AVAILABLE} if available else {}},
+        {'$facet': {
+            'available': [{'$match': {**both, '$expr': _AVAILABLE}}, {'$count': 'n'}],
+            'genres': counts('genre', for_genres, listing['genres']),
+            'authors': counts('author', for_authors, listing['authors']),
+        }},
+    ]
+
+
+def _first_count(facet, name):
+    values = facet.get(name) or []
+    return values[0]['n'] if values else 0
+
+
+def _aggregate(genre, author, available, page):
+    """Run the full `$facet`; returns `(listing, availability)` cache entries."""
+    rows = list(mongo_models.Book.objects.aggregate(_pipeline(genre, author, available, page)))
+    facet = rows[0] if rows else {}
+
+    def values(name):
+        return [v for v in facet.get(name) or [] if v['_id']]
+
+    listing = {
+        'books': facet.get('results') or [],
+        'total': _first_count(facet, 'total'),
+        'genres': [{'value': v['_id'], 'count': v['count']} for v in values('genres')],
+        'authors': [{'value': v['_id'], 'count': v['count']} for v in values('authors')],
+    }
+    availability = {
+        'available': _first_count(facet, 'available'),
+        'genres': {v['_id']: v['available'] for v in values('genres')},
+        'authors': {v['_id']: v['available'] for v in values('authors')},
+    }
+    return listing, availability
+
+
+def _aggregate_availability(genre, author, available, listing):
+    rows = list(mongo_models.Book.objects.aggregate(_availability_pipeline(genre, author, available, listing)))
+    facet = rows[0] if rows else {}
+    return {
+        'available': _first_count(facet, 'available'),
+        'genres': {v['_id']: v['available'] for v in facet.get('genres') or []},
+        'authors': {v['_id']: v['available'] for v in facet.get('authors') or []},
+    }
+
+
+def _with_current_copies(books):
+    """Copies of `books` with `available_copies` read fresh from the counters."""
+    current = live.availability([b['pk'] for b in books]) if books else {}
+    return [
+        dict(b, available_copies=current[b['pk']]['available'], total_copies=current[b['pk']]['total'])
+        if b['pk'] in current else b
+        for b in books
+    ]
+
+
+def _keys(genre, author, available, page):
+    books_gen, available_gen = _generations()
+    # with the availability filter on, the results themselves depend on it
+    listing_key = _cache_key('listing', (books_gen, available_gen if available else '-'), genre, author, int(available), page)
+    availability_key = _cache_key('available', (books_gen, available_gen), genre, author, int(available))
+    return listing_key, availability_key
+
+
+def is_cached(genre='', author='', available=False, page=1):
+    """True when `browse` has the listing for these filters in the cache."""
+    return cache.get(_keys(genre, author, available, page)[0]) is not None
+
+
+def browse_in_background(genre='', author='', available=False, page=1):
+    """Fill the cache for one filter combination from a daemon thread.
+
+    Returns False without starting anything while the same combination
+    is already being filled by this process.
+    """
+    args = (genre, author, available, page)
+    with _warming_lock:
+        if args in _warming:
+            return False
+        _warming.add(args)
+
+    def run():
+        try:
+            browse(*args)
+        except PyMongoError as e:
+            mongo_status.record_failure(e)
+            logger.exception('catalog facets warm-up failed')
+        except Exception:
+            logger.exception('catalog facets warm-up failed')
+        finally:
+            with _warming_lock:
+                _warming.discard(args)
+
+    threading.Thread(target=run, name='catalog-facets-warm', daemon=True).start()
+    return True
+
+
+def browse(genre='', author='', available=False, page=1):
+    """Return a dict with `books`, `total`, `available`, `genres`, `authors`.
+
+    `books` holds at most `page_size()` dicts with the same attributes the
+    catalog template uses (`pk`, `title`, `available_copies`, ...).
+    """
+    listing_key, availability_key = _keys(genre, author, available, page)
+    listing = cache.get(listing_key)
+    availability = cache.get(availability_key)
+    if listing is None:
+        listing, availability = _aggregate(genre, author, available, page)
+        cache.set_many({listing_key: listing, availability_key: availability}, _ttl())
+    elif availability is None:
+        availability = _aggregate_availability(genre, author, available, listing)
+        cache.set(availability_key, availability, _ttl())
+
+    def merged(name):
+        return [dict(v, available=availability[name].get(v['value'], 0)) for v in listing[name]]
+
+    return {
+        'books': _with_current_copies(listing['books']),
+        'total': listing['total'],
+        'available': availability['available'],
+        'genres': merged('genres'),
+        'authors': merged('authors'),
+    }
+
+
+def recount_active_borrows(book_ids=None, missing_only=False):
+    """Recompute `Book.active_borrows` from `borrow_records`.
+
+    Used to backfill the counter for existing data and to repair drift.
+    `book_ids` limits the recount to those books. With `missing_only`
+    only books that have no counter yet are set, and only while they
+    still have none, so it is safe to run while the site serves borrows.
+    Returns the number of books updated.
+    """
+    from pymongo import UpdateOne
+
+    books, loans = {}, {'returned': False}
+    if book_ids is not None:
+        books['_id'] = loans['book_id'] = {'$in': list(book_ids)}
+    if missing_only:
+        books['active_borrows'] = {'$exists': False}
+    coll = mongo_models.Book._get_collection()
+    if missing_only and not coll.find_one(books, {'_id': 1}):
+        return 0
+    pipeline = [{'$match': loans}, {'$group': {'_id': '$book_id', 'n': {'$sum': 1}}}]
+    active = {row['_id']: row['n'] for row in mongo_models.BorrowRecord.objects.aggregate(pipeline)}
+    ops, updated = [], 0
+    for doc in coll.find(books, {'active_borrows': 1}):
+        n = active.get(doc['_id'], 0)
+        if missing_only:
+            ops.append(UpdateOne({'_id': doc['_id'], 'active_borrows': {'$exists': False}}, {'$set': {'active_borrows': n}}))
+        elif doc.get('active_borrows') != n:
+            ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'active_borrows': n}}))
+        if len(ops) >= 1000:
+            updated += coll.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += coll.bulk_write(ops, ordered=False).modified_count
+    invalidate()
+    return updated
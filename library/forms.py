@@ -2,6 +2,10 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from . import mongo_models
+from . import facets
+from . import live
+from . import reservations
+from . import typeahead
 
 
 class RegisterForm(UserCreationForm):
@@ -40,7 +44,9 @@ class BookForm(forms.Form):
         """Create or update a `mongo_models.Book` document.
 
         If `instance` is provided (a mongo_models.Book), update it;
-        otherwise create a new document.
+        otherwise create a new document. A changed title is copied to the
+        book's borrow records with a single bulk update, and any copies
+        freed by a higher `total_copies` go to waiting reservations.
         """
         data = {
             'title': self.cleaned_data['title'],
@@ -48,12 +54,38 @@ class BookForm(forms.Form):
             'genre': self.cleaned_data.get('genre', ''),
             'total_copies': self.cleaned_data['total_copies'],
         }
+        old_title = None
         if instance is None:
             book = mongo_models.Book(**data)
         else:
+            old_title = instance.title
             for k, v in data.items():
                 setattr(instance, k, v)
             book = instance
         if commit:
             book.save()
+            if old_title is not None and old_title != book.title:
+                # keep the denormalised title on borrow records in step
+                mongo_models.BorrowRecord.objects(book_id=book.id).update(set__book_title=book.title)
+            reservations.promote_waiting([book.id])
+            typeahead.index_book(book)
+            facets.invalidate()
+            live.publish([book.id])
         return book
+
+
+class BulkBookForm(forms.Form):
+    """Staff form for applying one change to many selected books.
+
+    Leave `genre` empty to keep each book's genre; `copies_delta` adds or
+    removes copies (e.g. -2) on every selected book.
+    """
+
+    genre = forms.CharField(max_length=100, required=False)
+    copies_delta = forms.IntegerField(required=False, label='Adjust copies by')
+
+    def clean(self):
+        cleaned = super().clean()
+        if not cleaned.get('genre') and not cleaned.get('copies_delta'):
+            raise forms.ValidationError('Enter a genre or a copy adjustment.')
+        return cleaned
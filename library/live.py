@@ -0,0 +1,220 @@
+"""Live availability updates for open catalog pages (server-sent events).
+
+Views that change availability call `publish(book_ids)` after their
+write. It reads the current counts of those books with one query and
+passes a `{book_id: {'available': n, 'total': m}}` event to every
+subscriber watching any of them.
+
+Subscribers are the SSE connections served by `views.availability_stream`
+on the ASGI stack. Each one is a coroutine waiting on an `asyncio.Event`,
+so an idle connection costs a few kilobytes and no thread. Changes are
+merged into a per-connection dict until they are sent. A burst of borrows
+on one book therefore sends only the latest count, and a connection never
+buffers more than one entry per book it watches.
+
+Without a broker, events only reach subscribers in the publishing
+process. Set `LIVE_UPDATES_BROKER_URL` to a Redis URL (e.g. a Redis on
+localhost) to fan out across workers. `publish` then sends each event to
+a Redis channel, and every worker relays it to its own subscribers.
+"""
+import asyncio
+import json
+import logging
+import threading
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+
+from . import mongo_models
+
+try:
+    import redis
+    import redis.asyncio as aioredis
+except Exception:
+    # redis is optional: without it updates stay within one process.
+    redis = aioredis = None
+
+logger = logging.getLogger(__name__)
+
+_CHANNEL = 'library:availability'
+
+_subscribers = set()
+_lock = threading.Lock()
+_publisher = None
+# event loop -> task relaying broker messages to that loop's subscribers
+_relays = {}
+_warned_no_redis = False
+
+
+def broker_url():
+    global _warned_no_redis
+    url = getattr(settings, 'LIVE_UPDATES_BROKER_URL', '')
+    if url and redis is None:
+        if not _warned_no_redis:
+            logger.warning('LIVE_UPDATES_BROKER_URL is set but redis is not installed; live updates stay in-process')
+            _warned_no_redis = True
+        return ''
+    return url
+
+
+def heartbeat():
+    return getattr(settings, 'LIVE_UPDATES_HEARTBEAT', 15)
+
+
+def max_books():
+    return getattr(settings, 'LIVE_UPDATES_MAX_BOOKS', 200)
+
+
+def parse_ids(value):
+    """Valid book ids from a comma-separated string, at most `max_books()`."""
+    ids = []
+    for part in value.split(','):
+        try:
+            ids.append(str(ObjectId(part.strip())))
+        except (InvalidId, TypeError):
+            continue
+        if len(ids) >= max_books():
+            break
+    return ids
+
+
+def availability(book_ids):
+    """Current `{book_id: {'available': n, 'total': m}}` for `book_ids`.
+
+    Invalid ids and ids of books that no longer exist are left out.
+    """
+    ids = []
+    for book_id in book_ids:
+        try:
+            ids.append(ObjectId(str(book_id)))
+        except InvalidId:
+            continue
+    docs = mongo_models.Book._get_collection().find(
+        {'_id': {'$in': ids}},
+        {'total_copies': 1, 'active_borrows': 1, 'held_copies': 1},
+    )
+    return {
+        str(d['_id']): {
+            'available': max(0, (d.get('total_copies') or 0) - (d.get('active_borrows') or 0) - (d.get('held_copies') or 0)),
+            'total': d.get('total_copies') or 0,
+        }
+        for d in docs
+    }
+
+
+class Subscription:
+    """One SSE connection: the books it watches and the changes not yet sent."""
+
+    def __init__(self, book_ids, loop):
+        self.book_ids = frozenset(book_ids)
+        self.loop = loop
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def _deliver(self, changes):
+        # runs on self.loop
+        self.pending.update(changes)
+        self.ready.set()
+
+    def offer(self, event):
+        """Queue the part of `event` this connection watches; any thread."""
+        changes = {k: v for k, v in event.items() if k in self.book_ids}
+        if changes:
+            try:
+                self.loop.call_soon_threadsafe(self._deliver, changes)
+            except RuntimeError:
+                # the loop is closed; the connection is gone
+                unsubscribe(self)
+
+    async def next(self, timeout):
+        """Wait up to `timeout` seconds and return the pending changes (maybe none)."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.ready.clear()
+        changes, self.pending = self.pending, {}
+        return changes
+
+
+def subscribe(book_ids):
+    """Register a subscription for `book_ids`; call from the serving event loop."""
+    loop = asyncio.get_running_loop()
+    subscription = Subscription(book_ids, loop)
+    with _lock:
+        _subscribers.add(subscription)
+    url = broker_url()
+    if url:
+        _ensure_relay(loop, url)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        _subscribers.discard(subscription)
+
+
+def _dispatch(event):
+    with _lock:
+        subscribers = list(_subscribers)
+    for subscription in subscribers:
+        subscription.offer(event)
+
+
+def publish(book_ids):
+    """Push the current availability of `book_ids` to live subscribers.
+
+    Best effort: errors are logged, never raised, so a failed update can
+    not fail the borrow or edit that triggered it. Without a broker and
+    with no subscribers in this process it does nothing.
+    """
+    url = broker_url()
+    if not book_ids or (not url and not _subscribers):
+        return
+    try:
+        event = availability(book_ids)
+        if not event:
+            return
+        if url:
+            _redis_client(url).publish(_CHANNEL, json.dumps(event))
+        else:
+            _dispatch(event)
+    except Exception:
+        logger.exception('Could not publish availability update')
+
+
+def _redis_client(url):
+    global _publisher
+    if _publisher is None:
+        _publisher = redis.Redis.from_url(url)
+    return _publisher
+
+
+def _ensure_relay(loop, url):
+    with _lock:
+        task = _relays.get(loop)
+        if task is None or task.done():
+            _relays[loop] = loop.create_task(_relay(url))
+
+
+async def _relay(url):
+    """Forward events from the broker to this process's subscribers."""
+    while True:
+        try:
+            client = aioredis.from_url(url)
+            pubsub = client.pubsub()
+            await pubsub.subscribe(_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get('type') == 'message':
+                    _dispatch(json.loads(message['data']))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Lost the live updates broker connection; reconnecting')
+            await asyncio.sleep(5)
+
+
+def format_event(changes):
+    """Encode changes as one `availability` server-sent event."""
+    return f'event: availability\ndata: {json.dumps(changes)}\n\n'
@@ -0,0 +1,22 @@
+"""Management command to bundle and minify the app's CSS and JavaScript.
+
+Usage:
+  python manage.py build_assets
+  python manage.py build_assets && python manage.py collectstatic --noinput
+
+Writes the bundles listed in `library.assets.BUNDLES` into `static/`.
+Run it after editing anything under `assets/`, then commit the output;
+`collectstatic` fingerprints and precompresses the bundles.
+"""
+from django.core.management.base import BaseCommand
+
+from library import assets
+
+
+class Command(BaseCommand):
+    help = 'Bundle and minify the CSS/JS sources in assets/ into static/.'
+
+    def handle(self, *args, **options):
+        for name, source_bytes, output_bytes in assets.build():
+            self.stdout.write(f'{name}: {source_bytes} -> {output_bytes} bytes')
+        self.stdout.write(self.style.SUCCESS('Assets built'))
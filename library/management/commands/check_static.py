@@ -0,0 +1,161 @@
+"""Management command to report what a page load costs in static assets.
+
+Usage:
+  python manage.py collectstatic --noinput
+  python manage.py check_static
+  python manage.py check_static --path / --path /books/<id>/ --json
+
+Each page is rendered through the full middleware stack with Django's
+test client, the same way a browser would request it (`Accept-Encoding:
+br, gzip`). Every asset it references is then requested through
+WhiteNoise. For each page the report gives requests and body bytes
+transferred for three loads:
+
+- cold: empty cache, so the page and every asset are fetched;
+- warm: a later visit, so assets still fresh under `max-age` are not
+  requested and the rest are revalidated with `If-None-Match`;
+- reload: like warm, but the browser revalidates every asset except
+  those marked `immutable`.
+
+Assets on other hosts (e.g. the Bootstrap CDN) are counted but not
+fetched. Run with `DEBUG` off after `collectstatic`; otherwise the
+numbers describe the development setup, not production.
+"""
+import json
+import os
+import re
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class _AssetParser(HTMLParser):
+    """Collect stylesheet, script and image URLs from a page."""
+
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'link' and 'stylesheet' in (attrs.get('rel') or '').split():
+            url = attrs.get('href')
+        elif tag in ('script', 'img'):
+            url = attrs.get('src')
+        else:
+            url = None
+        if url and url not in self.urls:
+            self.urls.append(url)
+
+
+def _body_bytes(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def _host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*' and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+class Command(BaseCommand):
+    help = 'Report requests and bytes transferred for cold, warm and reload page loads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', help='Page to load (repeatable; default: /).')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        as_json = options['json']
+        warn = self.stderr.write
+        if settings.DEBUG:
+            warn('DEBUG is on: assets are served unhashed and uncached; run with DEBUG=false for production numbers.')
+        manifest = os.path.join(settings.STATIC_ROOT, getattr(staticfiles_storage, 'manifest_name', ''))
+        if not os.path.isfile(manifest):
+            warn('No staticfiles manifest found: run `python manage.py collectstatic` first.')
+
+        client = Client(HTTP_ACCEPT_ENCODING='br, gzip', HTTP_HOST=_host())
+        report = [self._page(client, path) for path in options['path'] or ['/']]
+        if as_json:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for page in report:
+            self._print_page(page)
+
+    def _page(self, client, path):
+        response = client.get(path)
+        page_bytes = _body_bytes(response)
+        parser = _AssetParser()
+        if response.status_code == 200 and 'html' in response.get('Content-Type', ''):
+            parser.feed(response.content.decode(response.charset or 'utf-8', 'replace'))
+
+        assets, external = [], []
+        for url in parser.urls:
+            if not url.startswith(settings.STATIC_URL):
+                external.append(url)
+                continue
+            assets.append(self._asset(client, url))
+
+        loads = {
+            'cold': {'requests': 1 + len(assets), 'bytes': page_bytes + sum(a['bytes'] for a in assets)},
+            'warm': {'requests': 1, 'bytes': page_bytes},
+            'reload': {'requests': 1, 'bytes': page_bytes},
+        }
+        for a in assets:
+            if not a['fresh']:
+                loads['warm']['requests'] += 1
+                loads['warm']['bytes'] += a['revalidated_bytes']
+            if not a['immutable']:
+                loads['reload']['requests'] += 1
+                loads['reload']['bytes'] += a['revalidated_bytes']
+        return {
+            'path': path,
+            'status': response.status_code,
+            'page_bytes': page_bytes,
+            'assets': assets,
+            'external': external,
+            'loads': loads,
+        }
+
+    def _asset(self, client, url):
+        response = client.get(url)
+        cache_control = response.get('Cache-Control', '')
+        max_age = _MAX_AGE.search(cache_control)
+        asset = {
+            'url': url,
+            'status': response.status_code,
+            'encoding': response.get('Content-Encoding', 'identity'),
+            'bytes': _body_bytes(response),
+            'cache_control': cache_control,
+            'fresh': bool(max_age and int(max_age.group(1)) > 0 and 'no-cache' not in cache_control),
+            'immutable': 'immutable' in cache_control,
+        }
+        # what a conditional request costs when the copy must be revalidated
+        conditional = {}
+        if response.get('ETag'):
+            conditional['HTTP_IF_NONE_MATCH'] = response['ETag']
+        if response.get('Last-Modified'):
+            conditional['HTTP_IF_MODIFIED_SINCE'] = response['Last-Modified']
+        asset['revalidated_bytes'] = _body_bytes(client.get(url, **conditional)) if conditional else asset['bytes']
+        return asset
+
+    def _print_page(self, page):
+        self.stdout.write(f"{page['path']} (HTTP {page['status']}, {page['page_bytes']:,} bytes of HTML)")
+        for a in page['assets']:
+            self.stdout.write(
+                f"  {a['url']:<48} {a['status']}  {a['encoding']:<8} {a['bytes']:>9,} B  {a['cache_control'] or '-'}"
+            )
+        for url in page['external']:
+            self.stdout.write(f'  {url:<48} external, not measured')
+        for name, load in page['loads'].items():
+            self.stdout.write(f"  {name:<6} {load['requests']:>3} requests {load['bytes']:>10,} bytes")
+        if page['external']:
+            self.stdout.write(f"  (+{len(page['external'])} external requests on a cold load)")
@@ -0,0 +1,44 @@
+"""Management command to deliver queued notifications from the outbox.
+
+Usage:
+  python manage.py drain_notifications                 # until empty
+  python manage.py drain_notifications --follow        # keep polling
+
+Jobs are claimed in batches, emailed through Django's configured
+EMAIL_BACKEND and marked sent in bulk (see `library.overdue.drain`).
+Several workers may run at once; each batch is claimed atomically.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import mongo_status
+from library import overdue
+
+
+class Command(BaseCommand):
+    help = 'Send pending notification jobs in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--follow', action='store_true', help='Keep polling for new jobs.')
+        parser.add_argument('--poll', type=int, default=30, help='Seconds between polls with --follow.')
+
+    def handle(self, *args, **options):
+        connected, mongo_err = mongo_status.get_status()
+        if not connected:
+            self.stderr.write(f'MongoDB not connected: {mongo_err}')
+            return
+
+        total_sent = total_skipped = 0
+        while True:
+            sent, skipped = overdue.drain(options['batch_size'])
+            total_sent += sent
+            total_skipped += skipped
+            if sent or skipped:
+                self.stdout.write(f'  batch: {sent} sent, {skipped} without email')
+                continue
+            if not options['follow']:
+                break
+            time.sleep(options['poll'])
+        self.stdout.write(self.style.SUCCESS(f'Sent {total_sent} notifications ({total_skipped} users without email)'))
@@ -13,6 +13,7 @@ from pathlib import Path
 
 from django.core.management.base import BaseCommand
 
+from library import facets
 from library import mongo_models
 from library.mongo_config import get_mongodb_uri
 
@@ -53,6 +54,7 @@ class Command(BaseCommand):
         cur.execute('SELECT id, title, author, genre, total_copies FROM library_book')
         rows = cur.fetchall()
         book_map = {}  # sqlite_id -> mongo_id
+        title_map = {r['id']: r['title'] for r in rows}  # sqlite_id -> title
         created = 0
         for r in rows:
             # avoid duplicates by legacy_id
@@ -86,7 +88,7 @@ class Command(BaseCommand):
                 user_id=int(r['user_id']),
                 username=username,
                 book_id=mongo_book_id,
-                book_title=str(r['book_id']),
+                book_title=title_map.get(sqlite_book_id, ''),
                 borrow_date=datetime.fromisoformat(r['borrow_date']) if r['borrow_date'] else None,
                 returned=bool(r['returned']),
             )
@@ -100,4 +102,8 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS(f'Imported {created} borrow records into MongoDB'))
 
+        # copy allocation reads the loan counter, not the borrow records
+        updated = facets.recount_active_borrows(book_ids=book_map.values())
+        self.stdout.write(self.style.SUCCESS(f'Updated active_borrows on {updated} books'))
+
         conn.close()
@@ -0,0 +1,50 @@
+"""Management command to flag overdue loans and queue notifications.
+
+Usage:
+  python manage.py overdue_sweep
+  python manage.py overdue_sweep --interval 300     # keep sweeping
+  python manage.py overdue_sweep --backfill-due-dates
+  python manage.py overdue_sweep --requeue
+
+See `library.overdue` for how a sweep works. `--backfill-due-dates` gives
+open loans created before due dates existed one loan period from their
+borrow date; `--requeue` re-queues jobs for every flagged open loan after
+an interrupted sweep.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import mongo_status
+from library import overdue
+
+
+class Command(BaseCommand):
+    help = 'Flag overdue loans and write notification jobs to the outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0, help='Repeat every N seconds (0 = run once).')
+        parser.add_argument('--backfill-due-dates', action='store_true', help='Set due dates on open loans that lack one first.')
+        parser.add_argument('--requeue', action='store_true', help='Queue jobs for all flagged open loans.')
+
+    def handle(self, *args, **options):
+        connected, mongo_err = mongo_status.get_status()
+        if not connected:
+            self.stderr.write(f'MongoDB not connected: {mongo_err}')
+            return
+
+        if options['backfill_due_dates']:
+            updated = overdue.backfill_due_dates()
+            self.stdout.write(f'Backfilled due dates on {updated} open loans')
+
+        requeue = options['requeue']
+        while True:
+            started = time.monotonic()
+            result = overdue.sweep(requeue=requeue)
+            self.stdout.write(self.style.SUCCESS(
+                f"Flagged {result['flagged']} overdue loans in {time.monotonic() - started:.2f}s"
+            ))
+            if options['interval'] <= 0:
+                return
+            requeue = False
+            time.sleep(options['interval'])
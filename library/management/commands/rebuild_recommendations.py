@@ -0,0 +1,67 @@
+"""Management command to build "also borrowed" recommendations.
+
+Usage:
+  python manage.py rebuild_recommendations                 # full rebuild
+  python manage.py rebuild_recommendations --incremental   # only new borrows
+  python manage.py rebuild_recommendations --synthetic 10000000
+
+`--synthetic` times a build over randomly generated borrow records
+without reading from or writing to MongoDB, to check that a given scale
+fits the machine. Every run ends with a per-phase timing report and the
+peak resident memory of the process.
+"""
+import resource
+
+from django.core.management.base import BaseCommand
+
+from library import mongo_status
+from library import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild co-borrowing recommendations from borrow records.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help='Apply borrows made since the last build only.')
+        parser.add_argument('--top-k', type=int, default=None, help='Neighbours kept per book (default: RECOMMENDATIONS_TOP_K).')
+        parser.add_argument('--block-size', type=int, default=512, help='Books per co-occurrence block; lower it to cap memory.')
+        parser.add_argument('--synthetic', type=int, default=0, metavar='RECORDS', help='Time a build over N random borrow records.')
+        parser.add_argument('--synthetic-users', type=int, default=1_000_000)
+        parser.add_argument('--synthetic-books', type=int, default=100_000)
+
+    def handle(self, *args, **options):
+        timer = recommendations.Timer()
+        k = options['top_k'] or recommendations.default_top_k()
+        try:
+            if options['synthetic']:
+                stats = self._synthetic(options, k, timer)
+            else:
+                connected, mongo_err = mongo_status.get_status()
+                if not connected:
+                    self.stderr.write(f'MongoDB not connected: {mongo_err}')
+                    return
+                build = recommendations.update if options['incremental'] else recommendations.rebuild
+                stats = build(k=k, block_size=options['block_size'], timer=timer)
+        except RuntimeError as e:
+            self.stderr.write(str(e))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['users']} users x {stats['books']} books, {stats['pairs']} distinct borrows; "
+            f"{stats['written']} neighbour lists built"
+        ))
+        self.stdout.write('\nTiming report:')
+        for name, seconds in timer.phases:
+            self.stdout.write(f'  {name:<30} {seconds:8.2f}s')
+        self.stdout.write(f"  {'total':<30} {timer.total:8.2f}s")
+        # ru_maxrss is reported in kilobytes on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(f"  {'peak memory':<30} {peak_mb:8.1f} MB")
+
+    def _synthetic(self, options, k, timer):
+        pairs = recommendations.synthetic_pairs(options['synthetic'], options['synthetic_users'], options['synthetic_books'])
+        with timer.phase('generate + load pairs'):
+            model = recommendations.CoBorrowModel.from_pairs(pairs)
+        with timer.phase('top-k co-occurrence'):
+            computed = sum(1 for _ in model.top_k(k=k, block_size=options['block_size']))
+        return {'users': len(model.user_ids), 'books': len(model.book_ids), 'pairs': model.matrix.nnz, 'written': computed}
@@ -0,0 +1,47 @@
+"""Management command to refresh the on-disk catalog snapshot.
+
+Usage:
+  python manage.py refresh_catalog_snapshot            # incremental
+  python manage.py refresh_catalog_snapshot --full     # rewrite every row
+  python manage.py refresh_catalog_snapshot --interval 60
+
+With `--interval` the command keeps running and refreshes periodically,
+which is handy as a sidecar process or cron replacement.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import catalog_snapshot
+from library import mongo_status
+
+
+class Command(BaseCommand):
+    help = 'Refresh the catalog snapshot used while MongoDB is unavailable.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild the snapshot from scratch.')
+        parser.add_argument('--interval', type=int, default=0, help='Repeat every N seconds (0 = run once).')
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            connected, mongo_err = mongo_status.get_status()
+            if not connected:
+                self.stderr.write(f'MongoDB not connected: {mongo_err}')
+            else:
+                try:
+                    started = time.monotonic()
+                    result = catalog_snapshot.refresh(full=full)
+                    elapsed = time.monotonic() - started
+                    kind = 'Full' if result['full'] else 'Incremental'
+                    self.stdout.write(self.style.SUCCESS(
+                        f"{kind} refresh: {result['updated']} books updated, "
+                        f"{result['removed']} removed in {elapsed:.2f}s"
+                    ))
+                except Exception as e:
+                    self.stderr.write(f'Snapshot refresh failed: {e}')
+            if options['interval'] <= 0:
+                return
+            full = False
+            time.sleep(options['interval'])
@@ -0,0 +1,118 @@
+"""Management command to repair denormalised data on borrow records.
+
+Usage:
+  python manage.py repair_borrow_records [--dry-run] [--batch-size 1000]
+
+`BorrowRecord.book_title` and `BorrowRecord.username` are copies of data
+owned by the book and the Django user; they drift when those change (and
+older imports stored the SQLite book id as the title). This command makes
+one streaming pass over `borrow_records` in `book_id` order. For each
+batch it resolves titles and usernames with one `$in` query per side,
+then sends all corrections in a single `bulk_write`. Records whose book no
+longer exists are flagged `book_deleted` and keep their title.
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from library import mongo_models
+from library import mongo_status
+
+# Lookup maps are dropped once they grow past this many entries, so memory
+# stays bounded on very large collections.
+_MAP_LIMIT = 100000
+
+
+class Command(BaseCommand):
+    help = 'Fix stale book titles and usernames on borrow records.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        connected, mongo_err = mongo_status.get_status()
+        if not connected:
+            self.stderr.write(f'MongoDB not connected: {mongo_err}')
+            return
+
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+        coll = mongo_models.BorrowRecord._get_collection()
+        books_coll = mongo_models.Book._get_collection()
+        total = coll.estimated_document_count()
+        titles, usernames = {}, {}
+        stats = {'scanned': 0, 'titles': 0, 'usernames': 0, 'orphaned': 0, 'written': 0}
+        started = time.monotonic()
+
+        cursor = coll.find(
+            {},
+            {'book_id': 1, 'book_title': 1, 'user_id': 1, 'username': 1, 'book_deleted': 1},
+        ).sort('book_id', 1).batch_size(batch_size)
+
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                self._repair_batch(batch, coll, books_coll, titles, usernames, stats, dry_run)
+                self._progress(stats, total, started)
+                batch = []
+        if batch:
+            self._repair_batch(batch, coll, books_coll, titles, usernames, stats, dry_run)
+            self._progress(stats, total, started)
+
+        verb = 'Would fix' if dry_run else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['titles']} titles, {stats['usernames']} usernames and flagged "
+            f"{stats['orphaned']} orphaned records out of {stats['scanned']} scanned "
+            f"({stats['written']} records {'to update' if dry_run else 'updated'}) in {time.monotonic() - started:.1f}s"
+        ))
+
+    def _repair_batch(self, batch, coll, books_coll, titles, usernames, stats, dry_run):
+        for cache in (titles, usernames):
+            if len(cache) > _MAP_LIMIT:
+                cache.clear()
+
+        missing_books = {d['book_id'] for d in batch} - titles.keys()
+        if missing_books:
+            found = {b['_id']: b.get('title') or '' for b in books_coll.find({'_id': {'$in': list(missing_books)}}, {'title': 1})}
+            for book_id in missing_books:
+                # None marks a book that no longer exists
+                titles[book_id] = found.get(book_id)
+
+        missing_users = {d['user_id'] for d in batch} - usernames.keys()
+        if missing_users:
+            found = dict(User.objects.filter(id__in=missing_users).values_list('id', 'username'))
+            for user_id in missing_users:
+                usernames[user_id] = found.get(user_id)
+
+        ops = []
+        for d in batch:
+            changes = {}
+            title = titles[d['book_id']]
+            if title is None:
+                if not d.get('book_deleted'):
+                    changes['book_deleted'] = True
+                    stats['orphaned'] += 1
+            elif d.get('book_title') != title:
+                changes['book_title'] = title
+                stats['titles'] += 1
+            username = usernames[d['user_id']]
+            if username is not None and d.get('username') != username:
+                changes['username'] = username
+                stats['usernames'] += 1
+            if changes:
+                ops.append(UpdateOne({'_id': d['_id']}, {'$set': changes}))
+
+        stats['scanned'] += len(batch)
+        if ops:
+            if not dry_run:
+                coll.bulk_write(ops, ordered=False)
+            stats['written'] += len(ops)
+
+    def _progress(self, stats, total, started):
+        elapsed = time.monotonic() - started
+        rate = stats['scanned'] / elapsed if elapsed else 0
+        self.stdout.write(f"  {stats['scanned']}/{total} scanned, {stats['written']} to fix ({rate:.0f} records/s)")
@@ -0,0 +1,198 @@
+"""Management command to stress copy allocation and the reservation queue.
+
+Usage:
+  python manage.py reservation_stress
+  python manage.py reservation_stress --threads 16 --users 64 --copies 3 --operations 5000
+
+Creates a scratch book and lets concurrent threads of simulated readers
+borrow, return, reserve and cancel against it through the same functions
+the views use (`library.reservations`). While it runs, a monitor checks
+that loans plus holds never exceed the copies; afterwards it checks:
+
+- `active_borrows` and `held_copies` equal a recount of open loans and
+  held reservations;
+- no copy is free while a reader is still waiting;
+- FIFO: no reservation that was already queued when another was put on
+  hold is still waiting while being older than it.
+
+The scratch book, its loans, reservations and notification jobs are
+deleted at the end. Simulated readers use user ids that no Django user
+has, so their notifications are never emailed.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from library import mongo_models
+from library import mongo_status
+from library import overdue
+from library import reservations
+
+# Simulated readers get ids from here up, far above real auto-increment ids.
+_FAKE_USER_BASE = 2_000_000_000
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent borrows, returns and reservations against a scratch book and verify invariants.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--users', type=int, default=32, help='Simulated readers, split across threads.')
+        parser.add_argument('--copies', type=int, default=3)
+        parser.add_argument('--operations', type=int, default=2000, help='Operations in total across all threads.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        connected, mongo_err = mongo_status.get_status()
+        if not connected:
+            self.stderr.write(f'MongoDB not connected: {mongo_err}')
+            return
+
+        threads = max(1, options['threads'])
+        users = max(threads, options['users'])
+        book = mongo_models.Book(
+            title=f'__reservation_stress__ {ObjectId()}',
+            author='stress',
+            genre='stress',
+            total_copies=options['copies'],
+        )
+        book.save()
+        self.book_id = book.id
+        # reservation id -> time its insert had completed
+        self.saved_at = {}
+        self.errors = []
+        self.violations = []
+        self.counts = {'borrow': 0, 'return': 0, 'reserve': 0, 'cancel': 0, 'no_copy': 0}
+        self.lock = threading.Lock()
+        started = time.monotonic()
+        try:
+            stop = threading.Event()
+            monitor = threading.Thread(target=self._monitor, args=(stop,), daemon=True)
+            monitor.start()
+            workers = []
+            per_thread = options['operations'] // threads
+            for t in range(threads):
+                ids = range(_FAKE_USER_BASE + t, _FAKE_USER_BASE + users, threads)
+                readers = [SimpleNamespace(id=i, username=f'stress-{i}', is_staff=False) for i in ids]
+                worker = threading.Thread(
+                    target=self._run, args=(book, readers, per_thread, random.Random(options['seed'] + t)),
+                )
+                workers.append(worker)
+                worker.start()
+            for worker in workers:
+                worker.join()
+            stop.set()
+            monitor.join()
+            elapsed = time.monotonic() - started
+            self._verify(book.id)
+        finally:
+            self._cleanup(book.id)
+
+        self.stdout.write(
+            f"{sum(self.counts.values())} operations in {elapsed:.1f}s: "
+            + ', '.join(f'{k} {v}' for k, v in self.counts.items())
+        )
+        for error in self.errors[:10]:
+            self.stderr.write(f'error: {error}')
+        for violation in self.violations[:20]:
+            self.stderr.write(f'violation: {violation}')
+        if self.errors or self.violations:
+            raise CommandError(f'{len(self.violations)} invariant violations, {len(self.errors)} errors')
+        self.stdout.write(self.style.SUCCESS('All allocation and FIFO invariants held'))
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def _violation(self, message):
+        with self.lock:
+            self.violations.append(message)
+
+    def _run(self, book, readers, operations, rnd):
+        try:
+            for _ in range(operations):
+                self._step(book, rnd.choice(readers), rnd)
+        except Exception as e:
+            with self.lock:
+                self.errors.append(repr(e))
+
+    def _step(self, book, reader, rnd):
+        loan = mongo_models.BorrowRecord.objects(user_id=reader.id, book_id=book.id, returned=False).first()
+        if loan is not None:
+            if mongo_models.BorrowRecord.objects(id=loan.id, returned=False).update_one(
+                set__returned=True, set__return_date=datetime.now(timezone.utc),
+            ):
+                reservations.release_copies(book.id)
+                self._count('return')
+            return
+
+        reservation = mongo_models.Reservation.objects(user_id=reader.id, book_id=book.id, active=True).first()
+        if reservation is not None and reservation.status == reservations.WAITING:
+            if rnd.random() < 0.1 and reservations.cancel(reservation.id, reader.id) is not None:
+                self._count('cancel')
+            return
+
+        claimed = reservations.claim_copy(book.id, reader.id)
+        if claimed is None:
+            if reservation is not None:
+                # the hold was cancelled or expired under us; try again later
+                return
+            self._count('no_copy')
+            created = reservations.reserve(book, reader)
+            if created is not None:
+                with self.lock:
+                    self.saved_at[created.id] = datetime.now(timezone.utc)
+                self._count('reserve')
+            return
+
+        now = datetime.now(timezone.utc)
+        mongo_models.BorrowRecord(
+            user_id=reader.id,
+            username=reader.username,
+            book_id=book.id,
+            book_title=book.title,
+            borrow_date=now,
+            due_date=overdue.due_date_for(now),
+        ).save()
+        self._count('borrow')
+
+    def _monitor(self, stop):
+        coll = mongo_models.Book._get_collection()
+        while not stop.is_set():
+            doc = coll.find_one({'_id': self.book_id}, {'total_copies': 1, 'active_borrows': 1, 'held_copies': 1})
+            active, held = doc.get('active_borrows', 0), doc.get('held_copies', 0)
+            # copies move between the counters in single updates, so never counted twice
+            if active < 0 or held < 0 or active + held > doc['total_copies']:
+                self._violation(f'active_borrows={active} held_copies={held} total_copies={doc["total_copies"]}')
+            time.sleep(0.005)
+
+    def _verify(self, book_id):
+        doc = mongo_models.Book._get_collection().find_one({'_id': book_id})
+        active = mongo_models.BorrowRecord.objects(book_id=book_id, returned=False).count()
+        held = mongo_models.Reservation.objects(book_id=book_id, status=reservations.HELD).count()
+        if doc.get('active_borrows', 0) != active:
+            self._violation(f'active_borrows is {doc.get("active_borrows")}, {active} loans are open')
+        if doc.get('held_copies', 0) != held:
+            self._violation(f'held_copies is {doc.get("held_copies")}, {held} reservations are held')
+        waiting = list(mongo_models.Reservation.objects(book_id=book_id, status=reservations.WAITING))
+        if waiting and active + held < doc['total_copies']:
+            self._violation(f'{doc["total_copies"] - active - held} copies free with {len(waiting)} readers waiting')
+
+        served = mongo_models.Reservation.objects(book_id=book_id, held_at__ne=None)
+        for r in served:
+            held_at = r.held_at.replace(tzinfo=timezone.utc)
+            for w in waiting:
+                saved = self.saved_at.get(w.id)
+                if saved is not None and saved < held_at and w.created_at < r.created_at:
+                    self._violation(f'reservation {w.id} still waiting after newer {r.id} was put on hold')
+
+    def _cleanup(self, book_id):
+        mongo_models.BorrowRecord.objects(book_id=book_id).delete()
+        mongo_models.Reservation.objects(book_id=book_id).delete()
+        mongo_models.NotificationJob.objects(book_id=book_id).delete()
+        mongo_models.Book.objects(id=book_id).delete()
@@ -0,0 +1,48 @@
+"""Management command to expire uncollected holds and fill free copies.
+
+Usage:
+  python manage.py reservation_sweep
+  python manage.py reservation_sweep --interval 300     # keep sweeping
+
+Holds past `RESERVATION_HOLD_HOURS` are closed in one `update_many` and
+their copies handed to the next reservations in line (see
+`library.reservations.expire_holds`). Any free copy left with readers
+still waiting, e.g. after an interrupted hand-off, is then put on hold.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import facets
+from library import live
+from library import mongo_status
+from library import reservations
+
+
+class Command(BaseCommand):
+    help = 'Expire uncollected reservation holds and pass copies to waiting readers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0, help='Repeat every N seconds (0 = run once).')
+
+    def handle(self, *args, **options):
+        connected, mongo_err = mongo_status.get_status()
+        if not connected:
+            self.stderr.write(f'MongoDB not connected: {mongo_err}')
+            return
+
+        while True:
+            started = time.monotonic()
+            result = reservations.expire_holds()
+            promoted = reservations.promote_waiting()
+            if result['expired'] or promoted:
+                # promote_waiting does not report its books
+                facets.invalidate_availability()
+                live.publish(result['book_ids'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Expired {result['expired']} holds, put {result['rehandled'] + promoted} reservations on hold "
+                f"in {time.monotonic() - started:.2f}s"
+            ))
+            if options['interval'] <= 0:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,92 @@
+"""Management command to measure the autocomplete prefix index.
+
+Usage:
+  python manage.py typeahead_benchmark                   # 1M synthetic titles
+  python manage.py typeahead_benchmark --titles 200000
+  python manage.py typeahead_benchmark --live            # current catalog
+
+Builds the index file into a temporary directory the way a worker does,
+then reports build time and the two memory costs: the file, which every
+worker maps read-only and so shares through the page cache, and what
+one worker allocates for itself when it opens the file (measured with
+tracemalloc). Lookup latency is reported as p50/p95/p99 over random
+prefixes of 1-6 characters against the mapped file.
+"""
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from library import typeahead
+
+
+def _synthetic_books(count, seed):
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 10))) for _ in range(50000)]
+    for i in range(count):
+        title = ' '.join(rnd.choices(words, k=rnd.randint(1, 6))).title()
+        author = ' '.join(rnd.choices(words, k=2)).title()
+        # skewed popularity: most books are rarely borrowed
+        yield f'{i:024x}', title, author, int(rnd.paretovariate(1.2))
+
+
+def _percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Measure build time, memory and lookup latency of the autocomplete index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=1_000_000, help='Synthetic catalog size.')
+        parser.add_argument('--queries', type=int, default=10000)
+        parser.add_argument('--live', action='store_true', help='Use the real catalog from MongoDB.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['live']:
+            books = list(typeahead._load_books())
+        else:
+            books = list(_synthetic_books(options['titles'], options['seed']))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'typeahead.idx')
+            started = time.perf_counter()
+            typeahead.PrefixIndex.write(path, books, datetime.utcnow())
+            build_seconds = time.perf_counter() - started
+            tracemalloc.start()
+            index = typeahead.PrefixIndex.open(path)
+            private = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self._report(options, books, index, build_seconds, private)
+
+    def _report(self, options, books, index, build_seconds, private):
+        rnd = random.Random(options['seed'])
+        samples = [typeahead.fold(b[1] if rnd.random() < 0.7 else b[2]) for b in rnd.sample(books, min(len(books), 1000))]
+        prefixes = []
+        for _ in range(options['queries']):
+            word = rnd.choice(rnd.choice(samples).split(' '))
+            prefixes.append(word[:rnd.randint(1, 6)])
+
+        latencies = []
+        for p in prefixes:
+            t0 = time.perf_counter()
+            index.search(p, 10)
+            latencies.append(time.perf_counter() - t0)
+        latencies.sort()
+
+        self.stdout.write(f'Books indexed:   {len(index)}')
+        self.stdout.write(f'Index keys:      {index.entries}')
+        self.stdout.write(f'Build time:      {build_seconds:.2f}s')
+        shared = index.shared_bytes
+        self.stdout.write(f'Shared file:     {shared / 1024 / 1024:.1f} MB ({shared / max(len(index), 1):.0f} bytes/book, mapped once per host)')
+        self.stdout.write(f'Per worker:      {private / 1024:.0f} KB allocated when opening the file')
+        self.stdout.write(f'Lookups:         {len(latencies)} random prefixes, top 10')
+        for pct in (50, 95, 99):
+            self.stdout.write(f'  p{pct}:           {_percentile(latencies, pct) * 1e6:.0f} us')
+        self.stdout.write(f'  max:           {latencies[-1] * 1e6:.0f} us')
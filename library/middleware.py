@@ -0,0 +1,283 @@
+"""Admission control: per-client rate limits and per-class concurrency caps.
+
+Bursts on expensive endpoints (password hashing in `login_view`, repeated
+`borrow_book` clicks) would otherwise queue up behind the worker pool and
+the MongoDB connection pool until cheap pages time out too. This
+middleware rejects excess requests early with `429 Too Many Requests` and
+a `Retry-After` header instead of queueing them:
+
+- a token bucket per client (user id, or IP for anonymous requests) and
+  URL name limits how often one client may hit an endpoint. `login` and
+  `register` are only limited on POST, per IP and submitted username,
+  with a looser per-IP cap so many people behind one NAT can still sign
+  in;
+- a concurrency cap per endpoint class (`auth`, `write`, `read`) limits
+  how many requests of that class run at once.
+
+Limits come from the `ADMISSION_CONTROL` setting. The default `local`
+backend keeps state in process memory; the `cache` backend keeps it in a
+Django cache (e.g. Redis or Memcached) so limits hold across workers.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+DEFAULTS = {
+    'ENABLED': True,
+    # 'local' (per process) or 'cache' (shared through CACHE_ALIAS)
+    'BACKEND': 'local',
+    'CACHE_ALIAS': 'default',
+    # URL name -> endpoint class; anything else is 'read'
+    'CLASSES': {
+        'login': 'auth',
+        'register': 'auth',
+        'borrow_book': 'write',
+        'return_book': 'write',
+        'bulk_return': 'write',
+        'reserve_book': 'write',
+        'cancel_reservation': 'write',
+        'admin_add_book': 'write',
+        'admin_edit_book': 'write',
+        'admin_delete_book': 'write',
+        'admin_bulk_update_books': 'write',
+    },
+    # endpoint class -> requests allowed to run at once (None = no cap)
+    'CONCURRENCY': {'auth': 4, 'write': 8, 'read': 32},
+    # URL name -> (burst, refill per second) per client
+    'RATES': {
+        'login': (5, 0.1),
+        'register': (3, 0.05),
+        'borrow_book': (5, 0.5),
+        'return_book': (10, 1),
+        'reserve_book': (5, 0.5),
+        'autocomplete': (20, 10),
+        # EventSource reconnects; one open stream per page
+        'availability_stream': (10, 0.5),
+    },
+    # URL name -> the only methods its RATES entry and class apply to;
+    # other methods count as ordinary reads (e.g. loading the login form)
+    'METHODS': {
+        'login': ('POST',),
+        'register': ('POST',),
+    },
+    # URL name -> POST field added to the bucket key, so one client's
+    # attempts against one account are limited separately
+    'KEY_FIELDS': {
+        'login': 'username',
+        'register': 'username',
+    },
+    # URL name -> (burst, refill per second) per client across all values
+    # of its KEY_FIELDS entry; loose, because a NAT shares one IP
+    'CLIENT_RATES': {
+        'login': (60, 1),
+        'register': (20, 0.2),
+    },
+    # applied to URL names not listed in RATES (None = unlimited)
+    'DEFAULT_RATE': (60, 10),
+    # Retry-After sent when a concurrency cap is hit
+    'RETRY_AFTER': 1,
+    # honour X-Forwarded-For when running behind trusted proxies; the
+    # client address is the entry TRUSTED_PROXY_COUNT places from the right,
+    # since entries further left are supplied by the client
+    'TRUST_X_FORWARDED_FOR': False,
+    'TRUSTED_PROXY_COUNT': 1,
+    # lifetime of shared concurrency counters, in case a worker dies
+    # before releasing its slot
+    'SLOT_TIMEOUT': 60,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'ADMISSION_CONTROL', {}))
+    return config
+
+
+class LocalBackend:
+    """In-process token buckets and concurrency counters."""
+
+    # Buckets kept before the least recently used ones are dropped.
+    MAX_BUCKETS = 100000
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, rate):
+        """Take one token; return 0 on success or seconds until one is free."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def acquire(self, name, limit):
+        with self._lock:
+            if self._running.get(name, 0) >= limit:
+                return False
+            self._running[name] = self._running.get(name, 0) + 1
+            return True
+
+    def release(self, name):
+        with self._lock:
+            self._running[name] = max(0, self._running.get(name, 0) - 1)
+
+
+class CacheBackend:
+    """Shared state in a Django cache, for limits across workers.
+
+    Token buckets are approximated with fixed windows of `burst / rate`
+    seconds allowing `burst` requests, because atomic `add`/`incr` are all
+    a generic cache offers.
+    """
+
+    def __init__(self, alias, slot_timeout):
+        self._cache = caches[alias]
+        self._slot_timeout = slot_timeout
+
+    def _incr(self, key, timeout):
+        if self._cache.add(key, 1, timeout):
+            return 1
+        try:
+            return self._cache.incr(key)
+        except ValueError:
+            # expired between add() and incr()
+            self._cache.set(key, 1, timeout)
+            return 1
+
+    def take(self, key, burst, rate):
+        window = max(1, math.ceil(burst / rate))
+        now = time.time()
+        bucket = int(now // window)
+        count = self._incr(f'admission:rate:{key}:{bucket}', window + 1)
+        if count <= burst:
+            return 0
+        return (bucket + 1) * window - now
+
+    def acquire(self, name, limit):
+        key = f'admission:running:{name}'
+        count = self._incr(key, self._slot_timeout)
+        # incr keeps the TTL set by add; extend it so the counter does not
+        # expire (and restart from zero) while requests are still running
+        self._cache.touch(key, self._slot_timeout)
+        if count > limit:
+            self.release(name)
+            return False
+        return True
+
+    def release(self, name):
+        key = f'admission:running:{name}'
+        try:
+            if self._cache.decr(key) < 0:
+                # the counter expired under a request that outlived
+                # SLOT_TIMEOUT; do not let it go negative and open the cap
+                self._cache.incr(key)
+        except ValueError:
+            pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend(config):
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if config['BACKEND'] == 'cache':
+                    _backend = CacheBackend(config['CACHE_ALIAS'], config['SLOT_TIMEOUT'])
+                else:
+                    _backend = LocalBackend()
+    return _backend
+
+
+def too_many_requests(retry_after):
+    response = HttpResponse('Too many requests. Please try again shortly.', status=429, content_type='text/plain')
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class AdmissionControlMiddleware:
+    """Reject requests over their rate or concurrency limit with a 429.
+
+    Runs in `process_view` so the URL name is known; must come after
+    `AuthenticationMiddleware` so clients can be identified by user.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_config()
+        self.backend = get_backend(self.config)
+
+    def __call__(self, request):
+        request._admission_slot = None
+        try:
+            return self.get_response(request)
+        finally:
+            if request._admission_slot is not None:
+                self.backend.release(request._admission_slot)
+
+    def _client(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        ip = request.META.get('REMOTE_ADDR', '')
+        if self.config['TRUST_X_FORWARDED_FOR']:
+            forwarded = [p.strip() for p in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if p.strip()]
+            hops = max(1, self.config['TRUSTED_PROXY_COUNT'])
+            if len(forwarded) >= hops:
+                ip = forwarded[-hops]
+        return f'ip:{ip}'
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        config = self.config
+        match = request.resolver_match
+        if not config['ENABLED'] or match is None or not match.url_name:
+            return None
+        name = match.url_name
+        methods = config['METHODS'].get(name)
+        special = methods is None or request.method in methods
+        client = self._client(request)
+
+        if special and name in config['CLIENT_RATES']:
+            burst, per_second = config['CLIENT_RATES'][name]
+            wait = self.backend.take(f'{client}:{name}:all', burst, per_second)
+            if wait:
+                return too_many_requests(wait)
+
+        rate = config['RATES'].get(name, config['DEFAULT_RATE']) if special else config['DEFAULT_RATE']
+        if rate is not None:
+            burst, per_second = rate
+            key = f'{client}:{name}'
+            field = config['KEY_FIELDS'].get(name) if special else None
+            if field:
+                value = request.POST.get(field, '').strip().lower()
+                # hashed so any submitted text is a safe cache key
+                key = f"{key}:{hashlib.sha1(value.encode('utf-8')).hexdigest()[:16]}"
+            wait = self.backend.take(key, burst, per_second)
+            if wait:
+                return too_many_requests(wait)
+
+        endpoint_class = config['CLASSES'].get(name, 'read') if special else 'read'
+        limit = config['CONCURRENCY'].get(endpoint_class)
+        if limit is not None:
+            if not self.backend.acquire(endpoint_class, limit):
+                return too_many_requests(config['RETRY_AFTER'])
+            request._admission_slot = endpoint_class
+        return None
@@ -5,10 +5,10 @@ application data (books and borrow records) in MongoDB using
 MongoEngine. This file provides `Book` and `BorrowRecord` documents with
 fields and helper methods analogous to the previous Django ORM models.
 """
-from datetime import datetime
+from datetime import datetime, timezone
 
 try:
-    from mongoengine import Document, StringField, IntField, DateTimeField, BooleanField, ObjectIdField
+    from mongoengine import Document, StringField, IntField, DateTimeField, BooleanField, ObjectIdField, ListField, DictField
     _MONGOENGINE_AVAILABLE = True
 except Exception:
     # mongoengine is not installed in the current environment. Define
@@ -21,7 +21,7 @@ except Exception:
             raise RuntimeError("mongoengine is not installed. Install 'mongoengine' to use MongoDB models.")
 
     Document = object
-    StringField = IntField = DateTimeField = BooleanField = ObjectIdField = lambda *a, **k: None
+    StringField = IntField = DateTimeField = BooleanField = ObjectIdField = ListField = DictField = lambda *a, **k: None
 
 
 class Book(Document):
@@ -31,7 +31,7 @@ class Book(Document):
     and total_copies. `id` will be an ObjectId assigned by MongoDB.
     """
 
-    meta = {'collection': 'books'}
+    meta = {'collection': 'books', 'indexes': ['updated_at', 'title', 'genre', 'author']}
 
     title = StringField(max_length=255, required=True)
     author = StringField(max_length=255, required=True)
@@ -39,10 +39,22 @@ class Book(Document):
     total_copies = IntField(default=1, min_value=0)
     # Optional legacy SQLite PK for migration bookkeeping
     legacy_id = IntField()
+    # Denormalised count of unreturned borrows, kept by borrow/return with
+    # atomic $inc so facet queries can filter on availability
+    active_borrows = IntField(default=0, min_value=0)
+    # Copies set aside for the reservation at the head of the waitlist
+    # (see library/reservations.py); not available to other borrowers
+    held_copies = IntField(default=0, min_value=0)
+    # Bumped on every save so the catalog snapshot can refresh incrementally
+    updated_at = DateTimeField(default=datetime.utcnow)
 
     def __str__(self):
         return f"{self.title} by {self.author}"
 
+    def save(self, *args, **kwargs):
+        self.updated_at = datetime.utcnow()
+        return super().save(*args, **kwargs)
+
     @property
     def borrowed_count(self):
         """Count active borrows for this book (returned=False).
@@ -55,8 +67,8 @@ class Book(Document):
 
     @property
     def available_copies(self):
-        """Compute available copies as total minus currently borrowed."""
-        return max(0, self.total_copies - self.borrowed_count)
+        """Copies neither on loan nor on hold, from the counters copy allocation uses."""
+        return max(0, self.total_copies - (self.active_borrows or 0) - (self.held_copies or 0))
 
 
 class BorrowRecord(Document):
@@ -64,10 +76,21 @@ class BorrowRecord(Document):
 
     We store `user_id` (the Django User PK) and `username` for display.
     The `book_id` references the Book's ObjectId. We also store
-    `book_title` to simplify listing without additional lookups.
+    `book_title` to simplify listing without additional lookups; edits to
+    a book's title are propagated here, and `repair_borrow_records` fixes
+    any copies that drifted.
     """
 
-    meta = {'collection': 'borrow_records', 'indexes': ['user_id', 'book_id']}
+    meta = {
+        'collection': 'borrow_records',
+        'indexes': [
+            'user_id', 'book_id', 'borrow_date', 'return_date',
+            # staff overdue view
+            ('returned', 'due_date'),
+            # overdue sweep: only loans not flagged yet are scanned
+            ('returned', 'overdue', 'due_date'),
+        ],
+    }
 
     # store the Django user primary key (int) and username for convenience
     user_id = IntField(required=True)
@@ -80,8 +103,129 @@ class BorrowRecord(Document):
     borrow_date = DateTimeField(default=datetime.utcnow)
     returned = BooleanField(default=False)
     return_date = DateTimeField()
+    # Set when the book was deleted from the catalog; `book_title` keeps
+    # the last known title for display
+    book_deleted = BooleanField(default=False)
+    # Loan period: set on borrow; `overdue` is flagged by the overdue sweep,
+    # which also records the sweep that flagged it
+    due_date = DateTimeField()
+    overdue = BooleanField(default=False)
+    overdue_sweep = ObjectIdField()
+    # Token of the bulk return that closed this loan (see library/bulk.py)
+    return_batch = ObjectIdField()
 
     def __str__(self):
         state = 'returned' if self.returned else 'borrowed'
         return f"{self.username} - {self.book_title} ({state})"
 
+    @property
+    def is_overdue(self):
+        if self.returned or self.due_date is None:
+            return False
+        due = self.due_date
+        if due.tzinfo is None:
+            due = due.replace(tzinfo=timezone.utc)
+        return due < datetime.now(timezone.utc)
+
+
+class BookRecommendation(Document):
+    """Precomputed "readers who borrowed this also borrowed" list for a book.
+
+    Built by the `rebuild_recommendations` command (see
+    `library.recommendations`). `neighbours` holds the top-K co-borrowed
+    books as dicts with `book_id`, `title` and `score`, so serving a book
+    page is a single indexed lookup on `book_id`.
+    """
+
+    meta = {'collection': 'book_recommendations'}
+
+    book_id = ObjectIdField(required=True, unique=True)
+    neighbours = ListField(DictField())
+    built_at = DateTimeField(default=datetime.utcnow)
+
+
+class NotificationJob(Document):
+    """A pending notification in the local outbox.
+
+    Jobs are written in bulk by the overdue sweep (and one at a time when
+    a reserved copy is put on hold) and drained in batches by
+    `drain_notifications`. The unique `(kind, borrow_id)` index makes
+    enqueueing idempotent, so a re-run sweep never queues a loan twice.
+    For `hold_ready` jobs `borrow_id` is the reservation's id and
+    `due_date` the hold expiry.
+    """
+
+    meta = {
+        'collection': 'notification_outbox',
+        'indexes': [
+            {'fields': ['kind', 'borrow_id'], 'unique': True},
+            ('status', 'created_at'),
+        ],
+    }
+
+    kind = StringField(max_length=50, required=True)
+    borrow_id = ObjectIdField(required=True)
+    user_id = IntField(required=True)
+    username = StringField(max_length=150)
+    book_id = ObjectIdField()
+    book_title = StringField(max_length=255)
+    due_date = DateTimeField()
+    # pending -> processing -> sent
+    status = StringField(max_length=20, default='pending')
+    attempts = IntField(default=0)
+    created_at = DateTimeField(default=datetime.utcnow)
+    claimed_at = DateTimeField()
+    # token of the worker batch currently holding the job
+    claim = ObjectIdField()
+    sent_at = DateTimeField()
+
+
+class Reservation(Document):
+    """A patron's place in the waitlist for a book with no free copies.
+
+    `waiting` reservations are served oldest first: a returned copy is put
+    on hold for the head of the queue (`held`) until `hold_expires`, when
+    the reservation is `fulfilled` by borrowing, `expired` by the sweep or
+    `cancelled`. `active` is set only while waiting or held, so a partial
+    unique index allows one open reservation per user and book.
+    """
+
+    meta = {
+        'collection': 'reservations',
+        'indexes': [
+            ('book_id', 'status', 'created_at'),
+            ('status', 'hold_expires'),
+            'user_id',
+            # incremental catalog snapshot refreshes look up recent hold changes
+            'held_at',
+            'closed_at',
+            {'fields': ['book_id', 'user_id'], 'unique': True, 'partialFilterExpression': {'active': True}},
+        ],
+    }
+
+    book_id = ObjectIdField(required=True)
+    book_title = StringField(max_length=255)
+    user_id = IntField(required=True)
+    username = StringField(max_length=150)
+    # waiting -> held -> fulfilled | expired | cancelled
+    status = StringField(max_length=20, default='waiting')
+    active = BooleanField(default=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+    held_at = DateTimeField()
+    hold_expires = DateTimeField()
+    closed_at = DateTimeField()
+    # Token of the expiry sweep that closed this hold
+    sweep = ObjectIdField()
+
+    @property
+    def is_hold_active(self):
+        """True while the reservation holds a copy that can still be collected."""
+        if self.status != 'held' or self.hold_expires is None:
+            return False
+        expires = self.hold_expires
+        if expires.tzinfo is None:
+            expires = expires.replace(tzinfo=timezone.utc)
+        return expires > datetime.now(timezone.utc)
+
+    def __str__(self):
+        return f"{self.username} - {self.book_title} ({self.status})"
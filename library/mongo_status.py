@@ -3,10 +3,22 @@
 Other modules import this to check whether the application successfully
 connected to MongoDB during startup and to display a friendly message
 when the DB is unavailable.
+
+`set_status` records the result of the startup ping. Failures seen later,
+at request time or by a background refresh, are reported with
+`record_failure`; for `MONGODB_BREAKER_SECONDS` afterwards `get_status`
+reports MongoDB as unavailable (a circuit breaker), so pages fall back to
+the catalog snapshot at once instead of each waiting out a timeout.
 """
+import time
+
 connected = False
 error = None
 
+# monotonic time until which request-time failures keep MongoDB marked down
+_tripped_until = 0.0
+_tripped_error = None
+
 
 def set_status(is_connected: bool, err=None):
     global connected, error
@@ -14,5 +26,15 @@ def set_status(is_connected: bool, err=None):
     error = None if err is None else str(err)
 
 
+def record_failure(err):
+    """Open the circuit breaker after a MongoDB operation failed."""
+    global _tripped_until, _tripped_error
+    from django.conf import settings
+    _tripped_until = time.monotonic() + getattr(settings, 'MONGODB_BREAKER_SECONDS', 30)
+    _tripped_error = str(err)
+
+
 def get_status():
+    if connected and time.monotonic() < _tripped_until:
+        return False, _tripped_error
     return connected, error
@@ -0,0 +1,175 @@
+"""Loan periods, the overdue sweep and the notification outbox.
+
+A sweep is two server-side statements, however many loans are overdue:
+
+1. one `update_many` over the `(returned, overdue, due_date)` index flags
+   every open loan past its due date that is not flagged yet, tagging the
+   records with the sweep's id. Loans flagged by earlier sweeps are
+   outside the scanned index range, so they cost nothing however many
+   stay overdue;
+2. one aggregation over the records tagged with that id writes an
+   `overdue` job per loan into the `notification_outbox` collection with
+   `$merge` (existing jobs are kept, so re-runs never duplicate).
+
+No borrow record is read into Python. A worker (`drain_notifications`)
+then claims jobs in batches, emails the borrowers and marks the jobs sent.
+The same outbox carries `hold_ready` jobs queued by `library.reservations`.
+"""
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import get_connection, EmailMessage
+
+from . import mongo_models
+
+OVERDUE = 'overdue'
+
+# Jobs stuck in `processing` longer than this (e.g. a worker crashed) are
+# handed out again.
+_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def loan_period():
+    return timedelta(days=getattr(settings, 'LOAN_PERIOD_DAYS', 14))
+
+
+def due_date_for(borrow_date):
+    return borrow_date + loan_period()
+
+
+def _outbox_pipeline(match):
+    return [
+        {'$match': match},
+        {'$project': {
+            '_id': 0,
+            'kind': OVERDUE,
+            'borrow_id': '$_id',
+            'user_id': 1,
+            'username': 1,
+            'book_id': 1,
+            'book_title': 1,
+            'due_date': 1,
+            'status': 'pending',
+            'attempts': {'$literal': 0},
+            'created_at': '$$NOW',
+        }},
+        {'$merge': {
+            'into': mongo_models.NotificationJob._get_collection_name(),
+            'on': ['kind', 'borrow_id'],
+            'whenMatched': 'keepExisting',
+            'whenNotMatched': 'insert',
+        }},
+    ]
+
+
+def sweep(now=None, requeue=False):
+    """Flag overdue loans and queue one notification per newly flagged loan.
+
+    With `requeue`, jobs are (re)queued for every open flagged loan, which
+    recovers from a sweep that was interrupted between its two steps.
+    Returns a dict with the number of loans `flagged`.
+    """
+    now = now or datetime.now(timezone.utc)
+    # $merge needs the unique (kind, borrow_id) index to exist
+    mongo_models.NotificationJob.ensure_indexes()
+    mongo_models.BorrowRecord.ensure_indexes()
+    coll = mongo_models.BorrowRecord._get_collection()
+    sweep_id = ObjectId()
+    # None also matches loans saved before `overdue` existed; both values
+    # are point ranges on the (returned, overdue, due_date) index
+    result = coll.update_many(
+        {'returned': False, 'overdue': {'$in': [False, None]}, 'due_date': {'$lt': now}},
+        {'$set': {'overdue': True, 'overdue_sweep': sweep_id}},
+    )
+    match = {'returned': False, 'overdue': True} if requeue else {'overdue_sweep': sweep_id}
+    if result.modified_count or requeue:
+        coll.aggregate(_outbox_pipeline(match))
+    return {'flagged': result.modified_count}
+
+
+def backfill_due_dates():
+    """Give open loans made before due dates existed one loan period.
+
+    Runs as a single pipeline-style `update_many` on the server.
+    Returns the number of loans updated.
+    """
+    period_ms = int(loan_period().total_seconds() * 1000)
+    result = mongo_models.BorrowRecord._get_collection().update_many(
+        {'returned': False, 'due_date': None},
+        [{'$set': {'due_date': {'$add': ['$borrow_date', period_ms]}}}],
+    )
+    return result.modified_count
+
+
+def claim(batch_size, now=None):
+    """Atomically claim up to `batch_size` pending jobs for this worker."""
+    now = now or datetime.now(timezone.utc)
+    coll = mongo_models.NotificationJob._get_collection()
+    claimable = {'$or': [
+        {'status': 'pending'},
+        {'status': 'processing', 'claimed_at': {'$lt': now - _CLAIM_TIMEOUT}},
+    ]}
+    ids = [d['_id'] for d in coll.find(claimable, {'_id': 1}).sort('created_at', 1).limit(batch_size)]
+    if not ids:
+        return []
+    token = ObjectId()
+    # only jobs still claimable when the update runs get this worker's token
+    coll.update_many(
+        {'_id': {'$in': ids}, **claimable},
+        {'$set': {'status': 'processing', 'claimed_at': now, 'claim': token}, '$inc': {'attempts': 1}},
+    )
+    return list(coll.find({'claim': token}))
+
+
+def _hold_ready_message(job, email):
+    expires = job.get('due_date')
+    expires_text = expires.strftime('%Y-%m-%d %H:%M UTC') if expires else 'soon'
+    body = (
+        f"Hi {job.get('username') or 'reader'},\n\n"
+        f"A copy of \"{job.get('book_title')}\" you reserved is now on hold for you. "
+        f"Borrow it before {expires_text}, after which it goes to the next reader in line.\n"
+    )
+    return EmailMessage(f"Ready to borrow: {job.get('book_title')}", body, to=[email])
+
+
+def _message(job, email):
+    if job.get('kind') == 'hold_ready':
+        return _hold_ready_message(job, email)
+    return _overdue_message(job, email)
+
+
+def _overdue_message(job, email):
+    due = job.get('due_date')
+    due_text = due.strftime('%Y-%m-%d') if due else 'its due date'
+    body = (
+        f"Hi {job.get('username') or 'reader'},\n\n"
+        f"\"{job.get('book_title')}\" was due back on {due_text}. "
+        f"Please return it to the library as soon as possible.\n"
+    )
+    return EmailMessage(f"Overdue: {job.get('book_title')}", body, to=[email])
+
+
+def drain(batch_size=500):
+    """Send one batch of claimed jobs; return `(sent, skipped)`.
+
+    Emails for a batch go over one mail connection and the whole batch is
+    marked sent with a single `update_many`. Jobs for users without an
+    email address are marked sent without a message.
+    """
+    jobs = claim(batch_size)
+    if not jobs:
+        return 0, 0
+    emails = dict(
+        User.objects.filter(id__in={j['user_id'] for j in jobs}).exclude(email='').values_list('id', 'email')
+    )
+    messages = [_message(j, emails[j['user_id']]) for j in jobs if j['user_id'] in emails]
+    if messages:
+        connection = get_connection()
+        connection.send_messages(messages)
+    mongo_models.NotificationJob._get_collection().update_many(
+        {'_id': {'$in': [j['_id'] for j in jobs]}},
+        {'$set': {'status': 'sent', 'sent_at': datetime.now(timezone.utc)}, '$unset': {'claim': ''}},
+    )
+    return len(messages), len(jobs) - len(messages)
@@ -0,0 +1,297 @@
+"""Co-borrowing recommendations ("readers who borrowed this also borrowed").
+
+The model is a binary user x book matrix `A` built from `borrow_records`
+with SciPy sparse matrices. Book-to-book co-occurrence is `A.T @ A`; it is
+never materialised in full but computed a block of books at a time, and
+only the top-K neighbours of each book are kept, scored by cosine
+similarity (co-borrowers / sqrt(borrowers_i * borrowers_j)) so that
+blockbusters do not dominate every list.
+
+Results are written to the `book_recommendations` collection, one document
+per book, so `book_detail` serves them with a single indexed lookup.
+
+The matrix and its index maps are saved under
+`RECOMMENDATIONS_STATE_DIR` after each build. An incremental update loads
+that state, adds borrows made since the last watermark and recomputes the
+neighbour lists of the affected books only.
+
+NumPy/SciPy are only needed to build; serving works without them.
+"""
+import json
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from django.conf import settings
+
+from . import mongo_models
+
+try:
+    import numpy as np
+    from scipy import sparse
+    _SCIPY_AVAILABLE = True
+except Exception:
+    # numpy/scipy are optional: the web app only reads precomputed lists.
+    _SCIPY_AVAILABLE = False
+
+try:
+    from bson import ObjectId
+    from pymongo import ReplaceOne
+except Exception:
+    ObjectId = ReplaceOne = None
+
+# Re-read borrows slightly older than the watermark; the matrix is binary,
+# so re-adding a (user, book) pair is harmless.
+_WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Documents per bulk_write call when storing neighbour lists.
+_WRITE_BATCH = 1000
+
+
+def _require_scipy():
+    if not _SCIPY_AVAILABLE:
+        raise RuntimeError("numpy and scipy are required to build recommendations. Install 'numpy' and 'scipy'.")
+
+
+def _state_dir():
+    default = Path(settings.BASE_DIR) / 'recommendations'
+    return Path(getattr(settings, 'RECOMMENDATIONS_STATE_DIR', default))
+
+
+def default_top_k():
+    return getattr(settings, 'RECOMMENDATIONS_TOP_K', 10)
+
+
+def for_book(book_id, limit=None):
+    """Return the stored neighbour list for `book_id` (possibly empty)."""
+    rec = mongo_models.BookRecommendation.objects(book_id=book_id).only('neighbours').first()
+    if rec is None:
+        return []
+    neighbours = rec.neighbours or []
+    return neighbours[:limit] if limit else neighbours
+
+
+class Timer:
+    """Collects wall-clock time per named phase for the timing report."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    @property
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+
+class CoBorrowModel:
+    """Binary user x book borrow matrix with its row/column id maps."""
+
+    def __init__(self, matrix, user_ids, book_ids):
+        self.matrix = matrix
+        self.user_ids = list(user_ids)
+        self.book_ids = list(book_ids)
+        self._user_index = {u: i for i, u in enumerate(self.user_ids)}
+        self._book_index = {b: i for i, b in enumerate(self.book_ids)}
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build from an iterable of `(user_id, book_id)` pairs.
+
+        Pairs are streamed into compact int32 arrays, so memory stays at a
+        few bytes per borrow record regardless of the source size.
+        """
+        _require_scipy()
+        model = cls(sparse.csr_matrix((0, 0), dtype=np.float32), [], [])
+        model.add_pairs(pairs)
+        return model
+
+    def add_pairs(self, pairs):
+        """Add borrows to the matrix; return the set of touched book columns."""
+        rows, cols = array('i'), array('i')
+        for user_id, book_id in pairs:
+            r = self._user_index.get(user_id)
+            if r is None:
+                r = self._user_index[user_id] = len(self.user_ids)
+                self.user_ids.append(user_id)
+            c = self._book_index.get(book_id)
+            if c is None:
+                c = self._book_index[book_id] = len(self.book_ids)
+                self.book_ids.append(book_id)
+            rows.append(r)
+            cols.append(c)
+        if not rows:
+            return set()
+
+        shape = (len(self.user_ids), len(self.book_ids))
+        rows = np.frombuffer(rows, dtype=np.int32)
+        cols = np.frombuffer(cols, dtype=np.int32)
+        delta = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+        matrix = self.matrix.copy()
+        matrix.resize(shape)
+        matrix = (matrix + delta).tocsr()
+        # a user borrowing the same book twice still counts once
+        matrix.data[:] = 1
+        self.matrix = matrix
+
+        # Every book already borrowed by a touched user gains a co-borrow
+        # pair with the new books, so their lists need recomputing too.
+        touched_users = np.unique(rows)
+        touched = set(np.unique(cols).tolist())
+        touched.update(np.unique(matrix[touched_users].indices).tolist())
+        return touched
+
+    def top_k(self, columns=None, k=10, block_size=512):
+        """Yield `(book_column, [(neighbour_column, score), ...])`.
+
+        Co-occurrence rows are computed `block_size` books at a time, which
+        bounds peak memory to one block of `A.T @ A` instead of the whole
+        book x book matrix.
+        """
+        _require_scipy()
+        by_book = self.matrix.T.tocsr()
+        borrowers = np.asarray(self.matrix.sum(axis=0)).ravel()
+        columns = np.arange(len(self.book_ids)) if columns is None else np.asarray(sorted(columns))
+        for start in range(0, len(columns), block_size):
+            block = columns[start:start + block_size]
+            co = (by_book[block] @ self.matrix).tocsr()
+            for r, book in enumerate(block):
+                lo, hi = co.indptr[r], co.indptr[r + 1]
+                neighbours, counts = co.indices[lo:hi], co.data[lo:hi]
+                keep = neighbours != book
+                neighbours, counts = neighbours[keep], counts[keep]
+                if not len(neighbours):
+                    yield int(book), []
+                    continue
+                scores = counts / np.sqrt(borrowers[book] * borrowers[neighbours])
+                if len(scores) > k:
+                    best = np.argpartition(-scores, k)[:k]
+                    neighbours, scores = neighbours[best], scores[best]
+                order = np.argsort(-scores, kind='stable')
+                yield int(book), [(int(neighbours[i]), float(scores[i])) for i in order]
+
+    def save(self, directory, watermark):
+        directory.mkdir(parents=True, exist_ok=True)
+        sparse.save_npz(directory / 'matrix.npz', self.matrix)
+        np.save(directory / 'users.npy', np.asarray(self.user_ids, dtype=np.int64))
+        np.save(directory / 'books.npy', np.asarray(self.book_ids, dtype='U24'))
+        (directory / 'meta.json').write_text(json.dumps({'watermark': watermark.isoformat()}), encoding='utf-8')
+
+    @classmethod
+    def load(cls, directory):
+        """Return `(model, watermark)` or `(None, None)` if no state exists."""
+        _require_scipy()
+        meta = directory / 'meta.json'
+        if not meta.exists():
+            return None, None
+        matrix = sparse.load_npz(directory / 'matrix.npz').tocsr()
+        users = np.load(directory / 'users.npy').tolist()
+        books = np.load(directory / 'books.npy').tolist()
+        watermark = datetime.fromisoformat(json.loads(meta.read_text(encoding='utf-8'))['watermark'])
+        return cls(matrix, users, books), watermark
+
+
+def borrow_pairs(since=None, batch_size=50000):
+    """Stream `(user_id, book_id_str)` pairs from `borrow_records`."""
+    qs = mongo_models.BorrowRecord.objects
+    if since is not None:
+        qs = qs(borrow_date__gt=since)
+    cursor = qs.only('user_id', 'book_id').as_pymongo().batch_size(batch_size)
+    for doc in cursor:
+        yield int(doc['user_id']), str(doc['book_id'])
+
+
+def store(model, results, titles=None):
+    """Write neighbour lists to `book_recommendations` with bulk_write.
+
+    `titles` maps book id strings to titles; neighbours whose book is no
+    longer in the catalog are dropped. Returns the number of books written.
+    """
+    if titles is None:
+        titles = {str(d['_id']): d.get('title') or '' for d in mongo_models.Book.objects.only('title').as_pymongo()}
+    coll = mongo_models.BookRecommendation._get_collection()
+    now = datetime.now(timezone.utc)
+    ops, written = [], 0
+    for column, neighbours in results:
+        book_id = model.book_ids[column]
+        if book_id not in titles:
+            continue
+        entries = []
+        for n, score in neighbours:
+            nid = model.book_ids[n]
+            if nid in titles:
+                entries.append({'book_id': ObjectId(nid), 'title': titles[nid], 'score': round(score, 4)})
+        ops.append(ReplaceOne(
+            {'book_id': ObjectId(book_id)},
+            {'book_id': ObjectId(book_id), 'neighbours': entries, 'built_at': now},
+            upsert=True,
+        ))
+        if len(ops) >= _WRITE_BATCH:
+            coll.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+        written += len(ops)
+    return written
+
+
+def rebuild(k=None, block_size=512, timer=None):
+    """Full rebuild from every borrow record. Returns a stats dict."""
+    _require_scipy()
+    k = k or default_top_k()
+    timer = timer or Timer()
+    started = datetime.now(timezone.utc)
+    with timer.phase('load borrow records'):
+        model = CoBorrowModel.from_pairs(borrow_pairs())
+    # neighbour lists are streamed straight into bulk_write batches
+    with timer.phase('top-k co-occurrence + write'):
+        written = store(model, model.top_k(k=k, block_size=block_size))
+    with timer.phase('save state'):
+        model.save(_state_dir(), started)
+    return {'users': len(model.user_ids), 'books': len(model.book_ids), 'pairs': model.matrix.nnz, 'written': written}
+
+
+def update(k=None, block_size=512, timer=None):
+    """Apply borrows made since the last build; falls back to `rebuild`."""
+    _require_scipy()
+    k = k or default_top_k()
+    timer = timer or Timer()
+    with timer.phase('load state'):
+        model, watermark = CoBorrowModel.load(_state_dir())
+    if model is None:
+        return rebuild(k=k, block_size=block_size, timer=timer)
+    started = datetime.now(timezone.utc)
+    with timer.phase('load new borrows'):
+        touched = model.add_pairs(borrow_pairs(since=watermark - _WATERMARK_OVERLAP))
+    with timer.phase('top-k co-occurrence + write'):
+        written = store(model, model.top_k(columns=touched, k=k, block_size=block_size)) if touched else 0
+    with timer.phase('save state'):
+        model.save(_state_dir(), started)
+    return {'users': len(model.user_ids), 'books': len(model.book_ids), 'pairs': model.matrix.nnz, 'written': written}
+
+
+def synthetic_pairs(records, users, books, seed=0):
+    """Random `(user_id, book_id)` pairs with a skewed book popularity.
+
+    Used by `rebuild_recommendations --synthetic` to time a build at a
+    given scale without touching MongoDB.
+    """
+    _require_scipy()
+    rng = np.random.default_rng(seed)
+    chunk = 1_000_000
+    for start in range(0, records, chunk):
+        n = min(chunk, records - start)
+        u = rng.integers(0, users, size=n)
+        # Zipf-like: a small share of titles gets most of the borrows
+        b = np.minimum(rng.zipf(1.3, size=n) - 1, books - 1)
+        for user_id, book_id in zip(u.tolist(), b.tolist()):
+            yield user_id, str(book_id)
@@ -0,0 +1,329 @@
+"""Copy allocation, reservation waitlist and FIFO hand-off on return.
+
+Copies are allocated atomically on the `Book` document. A book has
+`total_copies`, of which `active_borrows` are on loan and `held_copies`
+are set aside for reservations. A new loan claims a copy with one
+conditional `$inc` that only matches while `active_borrows + held_copies
+< total_copies`, so two borrowers can never get the same last copy.
+
+When copies come back, each one is offered to the oldest `waiting`
+reservation with one `find_one_and_update` (sorted by `created_at`),
+which moves it to `held`. Only then is the copy moved from
+`active_borrows` to `held_copies`. Until that second update the copy
+still counts as on loan, so nobody else can claim it in between.
+The patron holding it claims it by borrowing before `hold_expires`.
+Holds not collected in time are released in batches by `expire_holds`,
+which passes the copies on to the next reservations in line.
+
+Counters are never decremented below zero. Books stored before
+`active_borrows` existed have no counter until `recount_active_borrows`
+backfills it; until then no free copy is allocated on them.
+"""
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from . import mongo_models
+
+try:
+    from mongoengine.errors import NotUniqueError
+except Exception:
+    NotUniqueError = DuplicateKeyError
+
+WAITING = 'waiting'
+HELD = 'held'
+FULFILLED = 'fulfilled'
+EXPIRED = 'expired'
+CANCELLED = 'cancelled'
+
+HOLD_READY = 'hold_ready'
+
+# Matches a book with at least one copy neither on loan nor on hold. A
+# book whose loan counter was never backfilled matches nothing.
+_HAS_FREE_COPY = {
+    'active_borrows': {'$type': 'number'},
+    '$expr': {'$lt': [
+        {'$add': ['$active_borrows', {'$ifNull': ['$held_copies', 0]}]},
+        '$total_copies',
+    ]},
+}
+
+
+def hold_period():
+    return timedelta(hours=getattr(settings, 'RESERVATION_HOLD_HOURS', 48))
+
+
+def _books():
+    return mongo_models.Book._get_collection()
+
+
+def _reservations():
+    return mongo_models.Reservation._get_collection()
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _adjusted(field, delta):
+    """Update-pipeline expression adding `delta` to counter `field`, floored at zero.
+
+    An `active_borrows` counter that was never backfilled stays unset, so
+    the backfill still counts every open loan.
+    """
+    value = f'${field}'
+    adjusted = {'$max': [0, {'$add': [{'$ifNull': [value, 0]}, delta]}]}
+    if field != 'active_borrows':
+        return adjusted
+    return {'$cond': [{'$eq': [{'$type': value}, 'missing']}, '$$REMOVE', adjusted]}
+
+
+def _adjust_counters(deltas):
+    """Pipeline update applying `{field: delta}` to a book's counters."""
+    return [{'$set': {field: _adjusted(field, delta) for field, delta in deltas.items()}}]
+
+
+def claim_copy(book_id, user_id):
+    """Reserve a copy for a new loan by `user_id`.
+
+    Uses the user's own hold when they have one, otherwise takes a free
+    copy. Returns `'hold'`, `'free'`, or None when nothing is available.
+    Call `unclaim_copy` if the loan is then not created.
+
+    Taking a free copy fulfils the user's open reservation for the book,
+    so they are not later handed a hold on a book they already have; a
+    copy put on hold for them in the meantime is passed on.
+    """
+    now = _now()
+    hold = _reservations().find_one_and_update(
+        {'book_id': book_id, 'user_id': user_id, 'status': HELD, 'hold_expires': {'$gt': now}},
+        {'$set': {'status': FULFILLED, 'active': False, 'closed_at': now}},
+    )
+    if hold is not None:
+        _books().update_one({'_id': book_id}, _adjust_counters({'held_copies': -1, 'active_borrows': 1}))
+        return 'hold'
+    if _books().update_one({'_id': book_id, **_HAS_FREE_COPY}, {'$inc': {'active_borrows': 1}}).modified_count:
+        closed = _reservations().find_one_and_update(
+            {'book_id': book_id, 'user_id': user_id, 'status': {'$in': [WAITING, HELD]}},
+            {'$set': {'status': FULFILLED, 'active': False, 'closed_at': now}},
+        )
+        if closed is not None and closed['status'] == HELD:
+            # an expired hold not swept yet: its copy goes to the next reader
+            release_copies(book_id, 1, source='held_copies')
+        return 'free'
+    return None
+
+
+def unclaim_copy(book_id):
+    """Give back a copy claimed by `claim_copy` whose loan was not created."""
+    release_copies(book_id, 1)
+
+
+def _hand_off(book_id, count, now):
+    """Put up to `count` copies on hold for the oldest waiting reservations."""
+    handed = []
+    for _ in range(count):
+        reservation = _reservations().find_one_and_update(
+            {'book_id': book_id, 'status': WAITING},
+            {'$set': {'status': HELD, 'held_at': now, 'hold_expires': now + hold_period()}},
+            sort=[('created_at', 1), ('_id', 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if reservation is None:
+            break
+        handed.append(reservation)
+    _notify(handed)
+    return handed
+
+
+def release_copies(book_id, count=1, source='active_borrows'):
+    """Free `count` copies counted in `source` (loans or holds).
+
+    Each copy goes to the next waiting reservation if there is one,
+    otherwise back to the shelf. Returns how many were put on hold.
+
+    A reservation made between the hand-off and the counter update would
+    find no free copy yet, so copies that went back to the shelf are
+    offered to the waitlist once more after the update.
+    """
+    handed = len(_hand_off(book_id, count, _now()))
+    deltas = {source: -count}
+    deltas['held_copies'] = deltas.get('held_copies', 0) + handed
+    _books().update_one({'_id': book_id}, _adjust_counters(deltas))
+    if handed < count:
+        handed += promote_waiting([book_id])
+    return handed
+
+
+def release_many(counts):
+    """Free returned copies for several books: `{book_id: count}`.
+
+    Books nobody is waiting for are updated with one `bulk_write`; only
+    books with a waitlist go through the per-copy hand-off. Reservations
+    made on the other books meanwhile are served by one `promote_waiting`.
+    """
+    if not counts:
+        return 0
+    waiting = set(_reservations().distinct('book_id', {'book_id': {'$in': list(counts)}, 'status': WAITING}))
+    plain = [b for b in counts if b not in waiting]
+    handed = 0
+    if plain:
+        _books().bulk_write(
+            [UpdateOne({'_id': b}, _adjust_counters({'active_borrows': -counts[b]})) for b in plain],
+            ordered=False,
+        )
+        handed += promote_waiting(plain)
+    return handed + sum(release_copies(b, n) for b, n in counts.items() if b in waiting)
+
+
+_indexes_ready = False
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if not _indexes_ready:
+        mongo_models.Reservation.ensure_indexes()
+        _indexes_ready = True
+
+
+def reserve(book, user):
+    """Join the waitlist for `book`; returns the Reservation or None.
+
+    None means the user already has an open reservation for this book.
+    """
+    # the partial unique index is what rejects a second open reservation
+    _ensure_indexes()
+    reservation = mongo_models.Reservation(
+        book_id=book.id,
+        book_title=book.title,
+        user_id=user.id,
+        username=user.username,
+        created_at=_now(),
+    )
+    try:
+        reservation.save()
+    except (NotUniqueError, DuplicateKeyError):
+        return None
+    # a copy may have come back or been added while we were queueing
+    promote_waiting([book.id])
+    return reservation
+
+
+def cancel(reservation_id, user_id):
+    """Cancel the user's open reservation, passing on a held copy.
+
+    Returns the reservation's book id, or None when nothing was cancelled.
+    """
+    try:
+        reservation_id = ObjectId(reservation_id)
+    except (InvalidId, TypeError):
+        return None
+    now = _now()
+    closed = _reservations().find_one_and_update(
+        {'_id': reservation_id, 'user_id': user_id, 'status': {'$in': [WAITING, HELD]}},
+        {'$set': {'status': CANCELLED, 'active': False, 'closed_at': now}},
+    )
+    if closed is None:
+        return None
+    if closed['status'] == HELD:
+        release_copies(closed['book_id'], 1, source='held_copies')
+    return closed['book_id']
+
+
+def cancel_for_book(book_id):
+    """Cancel every open reservation for a book that is being deleted."""
+    return _reservations().update_many(
+        {'book_id': book_id, 'status': {'$in': [WAITING, HELD]}},
+        {'$set': {'status': CANCELLED, 'active': False, 'closed_at': _now()}},
+    ).modified_count
+
+
+def expire_holds(now=None):
+    """Release holds past `hold_expires` to the next reservations in line.
+
+    One `update_many` closes every expired hold under a sweep token; the
+    freed copies are then counted per book with one aggregation and handed
+    on. Returns a dict with `expired` and `rehandled` counts and the
+    `book_ids` whose holds expired.
+    """
+    now = now or _now()
+    token = ObjectId()
+    result = _reservations().update_many(
+        {'status': HELD, 'hold_expires': {'$lt': now}},
+        {'$set': {'status': EXPIRED, 'active': False, 'closed_at': now, 'sweep': token}},
+    )
+    if not result.modified_count:
+        return {'expired': 0, 'rehandled': 0, 'book_ids': []}
+    per_book = list(_reservations().aggregate([
+        {'$match': {'sweep': token}},
+        {'$group': {'_id': '$book_id', 'n': {'$sum': 1}}},
+    ]))
+    rehandled = sum(release_copies(row['_id'], row['n'], source='held_copies') for row in per_book)
+    return {'expired': result.modified_count, 'rehandled': rehandled, 'book_ids': [row['_id'] for row in per_book]}
+
+
+def promote_waiting(book_ids=None):
+    """Put free copies on hold for waiting reservations.
+
+    Copies become free without a return when staff add copies or a
+    reservation is made just as a copy comes back. Each free copy is first
+    claimed on the book, then given to the oldest waiting reservation.
+    Returns the number of reservations put on hold.
+    """
+    query = {'status': WAITING}
+    if book_ids is not None:
+        query['book_id'] = {'$in': list(book_ids)}
+    promoted = 0
+    for book_id in _reservations().distinct('book_id', query):
+        while _books().update_one({'_id': book_id, **_HAS_FREE_COPY}, {'$inc': {'held_copies': 1}}).modified_count:
+            if not _hand_off(book_id, 1, _now()):
+                _books().update_one({'_id': book_id}, _adjust_counters({'held_copies': -1}))
+                break
+            promoted += 1
+    return promoted
+
+
+def recount_held_copies():
+    """Recompute `Book.held_copies` from held reservations; returns books updated."""
+    pipeline = [{'$match': {'status': HELD}}, {'$group': {'_id': '$book_id', 'n': {'$sum': 1}}}]
+    held = {row['_id']: row['n'] for row in _reservations().aggregate(pipeline)}
+    ops = [
+        UpdateOne({'_id': doc['_id']}, {'$set': {'held_copies': held.get(doc['_id'], 0)}})
+        for doc in _books().find({}, {'held_copies': 1})
+        if doc.get('held_copies', 0) != held.get(doc['_id'], 0)
+    ]
+    if not ops:
+        return 0
+    return _books().bulk_write(ops, ordered=False).modified_count
+
+
+def _notify(reservations):
+    """Queue a `hold_ready` notification for each newly held reservation."""
+    coll = mongo_models.NotificationJob._get_collection()
+    for r in reservations:
+        coll.update_one(
+            {'kind': HOLD_READY, 'borrow_id': r['_id']},
+            {'$setOnInsert': {
+                'user_id': r['user_id'],
+                'username': r.get('username'),
+                'book_id': r['book_id'],
+                'book_title': r.get('book_title'),
+                'due_date': r['hold_expires'],
+                'status': 'pending',
+                'attempts': 0,
+                'created_at': _now(),
+            }},
+            upsert=True,
+        )
+
+
+def queue_position(reservation):
+    """1-based position of a waiting reservation in its book's queue."""
+    ahead = mongo_models.Reservation.objects(
+        book_id=reservation.book_id, status=WAITING, created_at__lt=reservation.created_at,
+    ).count()
+    return ahead + 1
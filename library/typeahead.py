@@ -0,0 +1,714 @@
+"""In-process prefix index for title/author autocomplete.
+
+Suggestions are served from memory rather than MongoDB. Every book
+contributes a few folded keys (full title and author, and each later word
+of both, so "hob" finds "The Hobbit" and "tol" finds "J.R.R. Tolkien").
+A prefix lookup is two `bisect` calls over the sorted keys followed by
+picking the most popular books in that key range.
+
+The index is stored compactly so that several workers fit on a small
+instance. Folded titles and authors are one byte buffer, one line each;
+a key is not a string but the offset of its first word in that buffer,
+and the sorted keys are a `uint32` array of those offsets next to one of
+the book each belongs to. Ids, titles, authors and popularity are packed
+the same way. This base index is written to one file per host
+(`TYPEAHEAD_INDEX_PATH`) by the first worker that needs it and
+memory-mapped read-only by every worker, so its pages are shared through
+the OS page cache. Each worker only holds, as Python objects, what
+changed since the file was built (edited and new books, popularity
+changes) and cached results. `typeahead_benchmark` reports both costs:
+for 1M synthetic titles the file is about 150 MB, shared, and a worker
+opening it allocates under 1 MB of its own.
+
+Short prefixes match huge ranges, so the top results for every prefix of
+up to `_PRECOMPUTED_DEPTH` characters are computed when the file is
+built and other large ranges are cached on first use. Adding or removing
+a book only drops the cached prefixes of its own keys.
+
+The index is opened once per process (`warm_in_background` is called from
+`wsgi.py` and `asgi.py`) and kept current by `BookForm.save` and
+`admin_delete_book`. Edits made in any process since the file was built
+are picked up by a periodic incremental sync on `Book.updated_at`. The
+same sync refreshes the popularity (borrow count) of books borrowed since
+the previous one, so rankings follow borrows made in any process within
+one sync interval. Books deleted by other processes linger in this
+process's suggestions until the file is rebuilt, which happens once it is
+older than `TYPEAHEAD_INDEX_MAX_AGE`.
+"""
+import bisect
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from django.conf import settings
+
+from . import mongo_models
+from . import mongo_status
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows; workers there may each rebuild the file
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Largest number of suggestions a caller may ask for; caches keep this many.
+MAX_RESULTS = 20
+
+# Prefixes this short get their top results precomputed at build time.
+_PRECOMPUTED_DEPTH = 2
+
+# Key ranges up to this size are scanned directly instead of cached.
+_SCAN_LIMIT = 2000
+
+# Upper bound on lazily cached prefixes.
+_CACHE_SIZE = 20000
+
+# Keys sort below this sentinel, so [prefix, prefix + _HIGH) is a range scan.
+_HIGH = '\U0010ffff'
+
+# Control characters are folded to spaces, so no key contains the newline
+# that ends each line of the folded text buffer (and sorts below any key
+# character).
+_CONTROL = {i: ' ' for i in list(range(32)) + [127]}
+
+# File layout: header, then these sections (each padded to 8 bytes).
+_SECTIONS = (
+    'ids',              # 12-byte ObjectId per slot
+    'id_order',         # uint32 slots sorted by id
+    'popularity',       # uint32 per slot
+    'display_offsets',  # uint32 end offsets of title, author, title, ...
+    'display',          # UTF-8 titles and authors as given
+    'text',             # folded title and author per slot, one line each
+    'key_positions',    # uint32 offsets into `text`, sorted by key
+    'key_slots',        # uint32 slot of each key
+    'pinned',           # JSON {prefix: [slot, ...]}
+)
+_MAGIC = b'TYPEAHD1'
+# magic, built_at (UTC timestamp), books, then (offset, length) per section
+_HEADER = struct.Struct('<8sdQ' + 'QQ' * len(_SECTIONS))
+
+
+def fold(text):
+    """Lower-case, strip accents and collapse whitespace ("Émile " -> "emile")."""
+    text = (text or '').translate(_CONTROL)
+    if text.isascii():
+        return ' '.join(text.lower().split())
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.casefold().split())
+
+
+def _keys_for(title, author):
+    keys = set()
+    for text in (fold(title), fold(author)):
+        words = text.split(' ')
+        for i in range(len(words)):
+            keys.add(' '.join(words[i:]))
+    keys.discard('')
+    return keys
+
+
+class _KeyPrefixes:
+    """Sorted keys cut to their first `size` bytes, as a sequence for `bisect`."""
+
+    __slots__ = ('_text', '_at', '_positions', '_size')
+
+    def __init__(self, text, at, positions, size):
+        self._text = text
+        self._at = at
+        self._positions = positions
+        self._size = size
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __getitem__(self, i):
+        start = self._at + self._positions[i]
+        return self._text[start:start + self._size]
+
+
+class _SortedIds:
+    """Book ids in slot order of `id_order`, as a sequence for `bisect`."""
+
+    __slots__ = ('_buf', '_at', '_order')
+
+    def __init__(self, buf, at, order):
+        self._buf = buf
+        self._at = at
+        self._order = order
+
+    def __len__(self):
+        return len(self._order)
+
+    def __getitem__(self, i):
+        start = self._at + 12 * self._order[i]
+        return self._buf[start:start + 12]
+
+
+def _top(slots, popularity):
+    return heapq.nlargest(MAX_RESULTS, slots, key=lambda s: (popularity(s), -s))
+
+
+def _encode(books):
+    """Pack `(book_id, title, author, popularity)` tuples into file sections.
+
+    Keys are sorted bucket by bucket (their first two bytes), so only one
+    bucket's keys exist as Python objects at a time.
+    """
+    ids = bytearray()
+    popularity = array('I')
+    display_offsets = array('I')
+    display = bytearray()
+    text = bytearray()
+    line_starts = array('I')
+    buckets = {}
+    for book_id, title, author, pop in books:
+        ids += bytes.fromhex(str(book_id))
+        popularity.append(min(max(int(pop or 0), 0), 0xFFFFFFFF))
+        for value in (title or '', author or ''):
+            display += value.encode('utf-8')
+            display_offsets.append(len(display))
+            line = fold(value).encode('utf-8')
+            start = len(text)
+            line_starts.append(start)
+            text += line
+            text += b'\n'
+            if not line:
+                continue
+            pos = start
+            for word in line.split(b' '):
+                bucket = bytes(text[pos:pos + 2])
+                positions = buckets.get(bucket)
+                if positions is None:
+                    positions = buckets[bucket] = array('I')
+                positions.append(pos)
+                pos += len(word) + 1
+
+    key_positions = array('I')
+    key_slots = array('I')
+    for bucket in sorted(buckets):
+        positions = sorted(buckets.pop(bucket), key=lambda p: text[p:text.index(b'\n', p)])
+        key_positions.extend(positions)
+        key_slots.extend((bisect.bisect_right(line_starts, p) - 1) >> 1 for p in positions)
+    del line_starts
+
+    id_order = array('I', sorted(range(len(popularity)), key=lambda s: ids[12 * s:12 * s + 12]))
+    pinned = _pinned(text, key_positions, key_slots, popularity.__getitem__)
+    return {
+        'ids': ids,
+        'id_order': id_order,
+        'popularity': popularity,
+        'display_offsets': display_offsets,
+        'display': display,
+        'text': text,
+        'key_positions': key_positions,
+        'key_slots': key_slots,
+        'pinned': json.dumps(pinned, separators=(',', ':')).encode('utf-8'),
+    }, len(popularity)
+
+
+def _pinned(text, key_positions, key_slots, popularity):
+    """Top slots of every prefix of up to `_PRECOMPUTED_DEPTH` characters."""
+    pinned = {}
+    n = len(key_positions)
+    for depth in range(1, _PRECOMPUTED_DEPTH + 1):
+        i = 0
+        while i < n:
+            start = key_positions[i]
+            prefix = bytes(text[start:text.index(b'\n', start)]).decode('utf-8')[:depth]
+            if len(prefix) < depth:
+                i += 1
+                continue
+            p = prefix.encode('utf-8')
+            hi = bisect.bisect_right(_KeyPrefixes(text, 0, key_positions, len(p)), p, i)
+            pinned[prefix] = _top(set(key_slots[i:hi]), popularity)
+            i = hi
+    return pinned
+
+
+def _layout(sections, at):
+    """Section order with padding, and `{name: (offset, length)}` from `at`."""
+    parts, table = [], {}
+    for name in _SECTIONS:
+        data = sections[name]
+        length = len(data) * getattr(data, 'itemsize', 1)
+        table[name] = (at, length)
+        parts.append(data)
+        pad = -length % 8
+        if pad:
+            parts.append(b'\0' * pad)
+        at += length + pad
+    return parts, table
+
+
+def _timestamp(when):
+    return when.replace(tzinfo=timezone.utc).timestamp()
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over book titles and authors.
+
+    The base index lives in one buffer (`bytes` or a read-only `mmap`)
+    laid out as described in the module docstring. Books edited or added
+    after it was built are kept in Python: `_keys` and `_refs` are
+    parallel sorted lists of their folded keys and slots, `_moved` holds
+    base slots whose base keys no longer apply, and `_popularity_changes`
+    overrides base popularity.
+    """
+
+    def __init__(self, buf, table, books, built_at=None):
+        self._buf = buf
+        view = memoryview(buf)
+
+        def ints(name):
+            offset, length = table[name]
+            return view[offset:offset + length].cast('I')
+
+        self._id_order = ints('id_order')
+        self._base_popularity = ints('popularity')
+        self._display_offsets = ints('display_offsets')
+        self._key_positions = ints('key_positions')
+        self._key_slots = ints('key_slots')
+        self._ids_at = table['ids'][0]
+        self._display_at = table['display'][0]
+        self._text_at = table['text'][0]
+        offset, length = table['pinned']
+        self._pinned = json.loads(bytes(buf[offset:offset + length]).decode('utf-8'))
+        self._base_books = books
+        self.built_at = built_at
+
+        self._keys = []
+        self._refs = []
+        self._moved = set()
+        self._removed = set()
+        self._edited = {}
+        self._new = []
+        self._new_slots = {}
+        self._popularity_changes = {}
+        self._count = books
+        self._top = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def entries(self):
+        return len(self._key_positions) + len(self._keys)
+
+    @property
+    def shared_bytes(self):
+        """Size of the base buffer (shared between processes when mapped)."""
+        return len(self._buf)
+
+    @classmethod
+    def build(cls, books, built_at=None):
+        """Build in memory from `(book_id, title, author, popularity)` tuples."""
+        sections, count = _encode(books)
+        parts, table = _layout(sections, 0)
+        return cls(b''.join(parts), table, count, built_at)
+
+    @classmethod
+    def write(cls, path, books, built_at):
+        """Build from `books` into the file at `path`, replaced atomically."""
+        path = Path(path)
+        sections, count = _encode(books)
+        parts, table = _layout(sections, _HEADER.size)
+        header = _HEADER.pack(_MAGIC, _timestamp(built_at), count, *[v for name in _SECTIONS for v in table[name]])
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                for part in parts:
+                    f.write(part)
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    @classmethod
+    def open(cls, path):
+        """Map the index file at `path` read-only."""
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = _HEADER.unpack_from(buf)
+        if fields[0] != _MAGIC:
+            raise ValueError(f'{path} is not a typeahead index')
+        built_at = datetime.fromtimestamp(fields[1], timezone.utc).replace(tzinfo=None)
+        values = fields[3:]
+        table = {name: (values[2 * i], values[2 * i + 1]) for i, name in enumerate(_SECTIONS)}
+        return cls(buf, table, fields[2], built_at)
+
+    # -- slots --------------------------------------------------------------
+
+    def _popularity(self, slot):
+        value = self._popularity_changes.get(slot)
+        return self._base_popularity[slot] if value is None else value
+
+    def _rank_key(self, slot):
+        return (self._popularity(slot), -slot)
+
+    def _book(self, slot):
+        """`(book_id, title, author)` of a live slot."""
+        if slot >= self._base_books:
+            return self._new[slot - self._base_books]
+        start = self._ids_at + 12 * slot
+        book_id = bytes(self._buf[start:start + 12]).hex()
+        edited = self._edited.get(slot)
+        if edited is not None:
+            return (book_id,) + edited
+        ends = self._display_offsets
+        title_start = ends[2 * slot - 1] if slot else 0
+        title_end, author_end = ends[2 * slot], ends[2 * slot + 1]
+        at = self._display_at
+        return (
+            book_id,
+            bytes(self._buf[at + title_start:at + title_end]).decode('utf-8'),
+            bytes(self._buf[at + title_end:at + author_end]).decode('utf-8'),
+        )
+
+    def _slot_of(self, book_id):
+        slot = self._new_slots.get(book_id)
+        if slot is not None:
+            return slot
+        try:
+            raw = bytes.fromhex(book_id)
+        except ValueError:
+            return None
+        ids = _SortedIds(self._buf, self._ids_at, self._id_order)
+        i = bisect.bisect_left(ids, raw)
+        if i == len(ids) or ids[i] != raw:
+            return None
+        slot = self._id_order[i]
+        return None if slot in self._removed else slot
+
+    # -- lookups ------------------------------------------------------------
+
+    def _candidates(self, prefix):
+        """Slots with a key starting with `prefix`, and the size of the key range."""
+        p = prefix.encode('utf-8')
+        keys = _KeyPrefixes(self._buf, self._text_at, self._key_positions, len(p))
+        lo = bisect.bisect_left(keys, p)
+        hi = bisect.bisect_right(keys, p, lo)
+        slots = set(self._key_slots[lo:hi])
+        if self._moved:
+            if len(slots) < len(self._moved):
+                slots = {s for s in slots if s not in self._moved}
+            else:
+                slots -= self._moved
+        extra_lo = bisect.bisect_left(self._keys, prefix)
+        extra_hi = bisect.bisect_left(self._keys, prefix + _HIGH, extra_lo)
+        slots.update(self._refs[extra_lo:extra_hi])
+        return slots, (hi - lo) + (extra_hi - extra_lo)
+
+    def _rank(self, prefix):
+        return _top(self._candidates(prefix)[0], self._popularity)
+
+    def search(self, prefix, limit=10):
+        """Return up to `limit` `(book_id, title, author)` for `prefix`."""
+        p = fold(prefix)
+        if not p:
+            return []
+        limit = min(limit, MAX_RESULTS)
+        with self._lock:
+            slots = self._pinned.get(p)
+            if slots is None:
+                slots = self._top.get(p)
+                if slots is not None:
+                    self._top.move_to_end(p)
+            if slots is None:
+                candidates, size = self._candidates(p)
+                slots = _top(candidates, self._popularity)
+                if size > _SCAN_LIMIT:
+                    self._top[p] = slots
+                    if len(self._top) > _CACHE_SIZE:
+                        self._top.popitem(last=False)
+            return [self._book(s) for s in slots[:limit]]
+
+    # -- changes ------------------------------------------------------------
+
+    def _invalidate(self, slot, old_keys, new_keys):
+        """Update cached and pinned results after `slot` changed keys."""
+        def prefixes(keys):
+            return {key[:i] for key in keys for i in range(1, len(key) + 1)}
+
+        matching = prefixes(new_keys)
+        for prefix in prefixes(old_keys) | matching:
+            self._top.pop(prefix, None)
+            if len(prefix) > _PRECOMPUTED_DEPTH:
+                continue
+            pinned = self._pinned.get(prefix)
+            if pinned is None or (prefix not in matching and slot in pinned):
+                # new short prefix, or the book left a list it was ranked in
+                self._pinned[prefix] = self._rank(prefix)
+            elif prefix in matching and slot not in pinned:
+                merged = sorted(pinned + [slot], key=self._rank_key, reverse=True)
+                self._pinned[prefix] = merged[:MAX_RESULTS]
+
+    def _remove_keys(self, slot, keys):
+        """Drop the keys of an edited or new slot from the in-process lists."""
+        for key in keys:
+            i = bisect.bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i] == key:
+                if self._refs[i] == slot:
+                    del self._keys[i]
+                    del self._refs[i]
+                    break
+                i += 1
+
+    def _retire_base_keys(self, slot):
+        if slot < self._base_books:
+            self._moved.add(slot)
+
+    def add(self, book_id, title, author, popularity=None):
+        """Insert or update a book, keeping its popularity unless given."""
+        book_id = str(book_id)
+        with self._lock:
+            old_keys = set()
+            slot = self._slot_of(book_id)
+            if slot is not None:
+                _, old_title, old_author = self._book(slot)
+                old_keys = _keys_for(old_title, old_author)
+                self._remove_keys(slot, old_keys)
+                self._retire_base_keys(slot)
+                if slot < self._base_books:
+                    self._edited[slot] = (title, author)
+                else:
+                    self._new[slot - self._base_books] = (book_id, title, author)
+                if popularity is not None:
+                    self._popularity_changes[slot] = popularity
+            else:
+                slot = self._base_books + len(self._new)
+                self._new.append((book_id, title, author))
+                self._new_slots[book_id] = slot
+                self._popularity_changes[slot] = popularity or 0
+                self._count += 1
+            keys = _keys_for(title, author)
+            for key in keys:
+                i = bisect.bisect_right(self._keys, key)
+                self._keys.insert(i, key)
+                self._refs.insert(i, slot)
+            self._invalidate(slot, old_keys, keys)
+
+    def set_popularity(self, book_id, popularity):
+        """Change a book's popularity and re-rank the results it appears in."""
+        with self._lock:
+            slot = self._slot_of(str(book_id))
+            if slot is None or self._popularity(slot) == popularity:
+                return
+            increased = popularity > self._popularity(slot)
+            self._popularity_changes[slot] = popularity
+            _, title, author = self._book(slot)
+            keys = _keys_for(title, author)
+            for prefix in {key[:i] for key in keys for i in range(1, len(key) + 1)}:
+                self._top.pop(prefix, None)
+                pinned = self._pinned.get(prefix)
+                if pinned is None:
+                    continue
+                if increased or slot not in pinned:
+                    merged = sorted(set(pinned) | {slot}, key=self._rank_key, reverse=True)
+                    self._pinned[prefix] = merged[:MAX_RESULTS]
+                else:
+                    # a book outside the list may now outrank it
+                    self._pinned[prefix] = self._rank(prefix)
+
+    def remove(self, book_id):
+        book_id = str(book_id)
+        with self._lock:
+            slot = self._slot_of(book_id)
+            if slot is None:
+                return
+            _, title, author = self._book(slot)
+            keys = _keys_for(title, author)
+            self._remove_keys(slot, keys)
+            self._retire_base_keys(slot)
+            self._removed.add(slot)
+            self._new_slots.pop(book_id, None)
+            self._count -= 1
+            self._invalidate(slot, keys, set())
+
+
+# -- process-wide index -----------------------------------------------------
+
+_index = None
+_synced_at = None
+_last_sync_check = 0.0
+_build_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+
+def _sync_interval():
+    return getattr(settings, 'TYPEAHEAD_SYNC_INTERVAL', 60)
+
+
+def _index_path():
+    default = Path(settings.BASE_DIR) / 'typeahead.idx'
+    return Path(getattr(settings, 'TYPEAHEAD_INDEX_PATH', default))
+
+
+def _max_age():
+    return getattr(settings, 'TYPEAHEAD_INDEX_MAX_AGE', 86400)
+
+
+def _load_books():
+    """Yield `(id, title, author, borrow_count)` for every book."""
+    pipeline = [{'$group': {'_id': '$book_id', 'n': {'$sum': 1}}}]
+    borrows = {row['_id']: row['n'] for row in mongo_models.BorrowRecord.objects.aggregate(pipeline)}
+    for d in mongo_models.Book.objects.only('title', 'author').as_pymongo():
+        yield d['_id'], d.get('title') or '', d.get('author') or '', borrows.get(d['_id'], 0)
+
+
+def _open(path):
+    if not path.exists():
+        return None
+    try:
+        return PrefixIndex.open(path)
+    except (OSError, ValueError, struct.error):
+        logger.warning('Could not open typeahead index %s; rebuilding it', path, exc_info=True)
+        return None
+
+
+def _expired(index):
+    return (datetime.utcnow() - index.built_at).total_seconds() > _max_age()
+
+
+@contextmanager
+def _host_lock(path):
+    """Serialise rebuilds of the index file between processes on this host."""
+    if fcntl is None:
+        yield
+        return
+    try:
+        lock = open(path.with_name(path.name + '.lock'), 'a')
+    except OSError:
+        yield
+        return
+    with lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _open_or_build():
+    """Open this host's index file, rebuilding it first when missing or too old.
+
+    Returns None when there is no file and MongoDB is unavailable.
+    """
+    path = _index_path()
+    index = _open(path)
+    if index is not None and not _expired(index):
+        return index
+    connected, _ = mongo_status.get_status()
+    if not connected:
+        # an old index beats none while MongoDB is down
+        return index
+    with _host_lock(path):
+        # another worker may have rebuilt it while we waited for the lock
+        index = _open(path)
+        if index is not None and not _expired(index):
+            return index
+        started = datetime.utcnow()
+        t0 = time.perf_counter()
+        try:
+            PrefixIndex.write(path, _load_books(), started)
+            index = PrefixIndex.open(path)
+        except OSError:
+            logger.warning('Could not write typeahead index %s; building it in memory', path, exc_info=True)
+            index = PrefixIndex.build(_load_books(), started)
+        logger.info(
+            'typeahead index built: %d books, %d keys, %.1f MB in %.2fs',
+            len(index), index.entries, index.shared_bytes / 1024 / 1024, time.perf_counter() - t0,
+        )
+        return index
+
+
+def get_index():
+    """Return the process index, opening (or building) it on first use.
+
+    Returns None when MongoDB is unavailable and nothing was built yet.
+    """
+    global _index, _synced_at
+    if _index is not None:
+        return _index
+    with _build_lock:
+        if _index is None:
+            index = _open_or_build()
+            if index is None:
+                return None
+            # the first sync catches up on edits made since the file was built
+            _synced_at = index.built_at
+            _index = index
+    return _index
+
+
+def warm_in_background():
+    """Open the index in a daemon thread so the first request is fast."""
+    def run():
+        try:
+            get_index()
+        except Exception:
+            logger.exception('typeahead index build failed')
+
+    threading.Thread(target=run, name='typeahead-warm', daemon=True).start()
+
+
+def _maybe_sync():
+    """Fold in books edited or borrowed in any process since the last sync."""
+    global _synced_at, _last_sync_check
+    now = time.monotonic()
+    if _index is None or now - _last_sync_check < _sync_interval():
+        return
+    if not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        _last_sync_check = now
+        started = datetime.utcnow()
+        since = _synced_at - timedelta(seconds=5)
+        for d in mongo_models.Book.objects(updated_at__gt=since).only('title', 'author').as_pymongo():
+            _index.add(d['_id'], d.get('title') or '', d.get('author') or '')
+        borrowed = mongo_models.BorrowRecord.objects(borrow_date__gt=since).distinct('book_id')
+        if borrowed:
+            # absolute counts, so the overlap with the previous sync is harmless
+            pipeline = [{'$group': {'_id': '$book_id', 'n': {'$sum': 1}}}]
+            for row in mongo_models.BorrowRecord.objects(book_id__in=borrowed).aggregate(pipeline):
+                _index.set_popularity(row['_id'], row['n'])
+        _synced_at = started
+    except Exception:
+        logger.exception('typeahead sync failed')
+    finally:
+        _sync_lock.release()
+
+
+def suggest(prefix, limit=10):
+    """Top `limit` books whose title or author starts with `prefix`."""
+    index = get_index()
+    if index is None:
+        return []
+    _maybe_sync()
+    return index.search(prefix, limit)
+
+
+def index_book(book):
+    """Add or refresh a saved `mongo_models.Book` in the index."""
+    if _index is not None:
+        _index.add(book.id, book.title, book.author)
+
+
+def remove_book(book_id):
+    if _index is not None:
+        _index.remove(book_id)
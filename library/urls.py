@@ -17,10 +17,16 @@ urlpatterns = [
     path('books/<str:pk>/', views.book_detail, name='book_detail'),
     path('borrow/<str:pk>/', views.borrow_book, name='borrow_book'),
     path('return/<str:pk>/', views.return_book, name='return_book'),
+    path('books/<str:pk>/reserve/', views.reserve_book, name='reserve_book'),
+    path('reservations/<str:pk>/cancel/', views.cancel_reservation, name='cancel_reservation'),
     path('my-borrows/', views.my_borrows, name='my_borrows'),
+    path('my-borrows/return/', views.bulk_return, name='bulk_return'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('live/availability/', views.availability_stream, name='availability_stream'),
     # admin book management
     path('admin/books/', views.admin_book_list, name='admin_book_list'),
     path('admin/books/add/', views.admin_add_book, name='admin_add_book'),
+    path('admin/books/bulk/', views.admin_bulk_update_books, name='admin_bulk_update_books'),
     path('admin/books/<str:pk>/edit/', views.admin_edit_book, name='admin_edit_book'),
     path('admin/books/<str:pk>/delete/', views.admin_delete_book, name='admin_delete_book'),
 ]
@@ -7,41 +7,207 @@ request processing, permissions, and rendering templates.
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.views.decorators.http import require_POST
 from django.utils import timezone
-from django.http import Http404
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
 from django.conf import settings
 
 # Use MongoEngine models for app data
 from . import mongo_models
 from . import mongo_status
+from . import bulk
+from . import catalog_snapshot
+from . import facets
+from . import live
+from . import overdue
+from . import recommendations
+from . import reservations
+from . import typeahead
 from pymongo.errors import PyMongoError
-from .forms import RegisterForm, BookForm
+from .forms import RegisterForm, BookForm, BulkBookForm
 from django.contrib import messages
 
 
-def home(request):
-    """Render the catalog home page listing all books.
+def _querystring(request, **changes):
+    """Return the current query string with `changes` applied.
+
+    A falsy value removes the parameter; changing a filter resets `page`.
+    """
+    params = request.GET.copy()
+    if 'page' not in changes:
+        params.pop('page', None)
+    for key, value in changes.items():
+        if value:
+            params[key] = value
+        else:
+            params.pop(key, None)
+    return '?' + params.urlencode()
+
+
+def _keep_snapshot_warm():
+    """Revalidate the fallback snapshot in the background when it expires."""
+    try:
+        if catalog_snapshot.is_expired(catalog_snapshot.refreshed_at()):
+            catalog_snapshot.refresh_in_background()
+    except Exception:
+        # the snapshot is only a fallback; never fail the page over it
+        pass
+
+
+def _snapshot_page(page, size, mongo_err):
+    """Context for one catalog page read from the snapshot, marked stale."""
+    books, total, snapshot_at = catalog_snapshot.load_page((page - 1) * size, size)
+    return {
+        'books': books,
+        'total': total,
+        'mongo_error': mongo_err,
+        'stale': snapshot_at is not None,
+        'snapshot_at': snapshot_at,
+    }
+
 
-    Returns the `library/home.html` template with all Book objects.
+def _warm_start_page(page, size):
+    """Context for an unfiltered page from a fresh snapshot, or None.
+
+    Used while the facet cache has no entry for the page (typically a new
+    worker), so its first request does not wait for the `$facet`
+    aggregation; the cache is filled in the background meanwhile.
     """
-    # Check mongo connection status and avoid querying when it's down.
+    try:
+        books, total, snapshot_at = catalog_snapshot.load_page((page - 1) * size, size)
+    except Exception:
+        return None
+    if catalog_snapshot.is_expired(snapshot_at):
+        return None
+    facets.browse_in_background(page=page)
+    return {'books': books, 'total': total}
+
+
+def home(request):
+    """Render the catalog home page with genre/author/availability facets.
+
+    Every page and all facet counts come from one cached `$facet`
+    aggregation (see `library.facets`). While an unfiltered page is not
+    cached yet, it is served from a fresh on-disk snapshot (see
+    `library.catalog_snapshot`) without facets and cached in the
+    background. When MongoDB is unreachable, or a query fails at request
+    time, the page is served read-only from the snapshot and marked stale.
+    """
+    genre = request.GET.get('genre', '').strip()
+    author = request.GET.get('author', '').strip()
+    available = request.GET.get('available') == '1'
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    size = facets.page_size()
+    context = {'genre': genre, 'author': author, 'available_only': available}
+
     connected, mongo_err = mongo_status.get_status()
-    if not connected:
-        return render(request, 'library/home.html', {'books': [], 'mongo_error': mongo_err})
+    data = warm = None
+    if connected:
+        try:
+            if not (genre or author or available) and not facets.is_cached(page=page):
+                warm = _warm_start_page(page, size)
+            if warm is None:
+                data = facets.browse(genre, author, available, page)
+        except Exception as e:
+            # MongoDB failed at request time (outage after startup, auth
+            # revoked mid-run, ...): fall back to the snapshot like at boot.
+            mongo_status.record_failure(e)
+            mongo_err = str(e)
+
+    if warm is not None:
+        context.update(warm)
+    elif data is None:
+        context.update(_snapshot_page(page, size, mongo_err))
+    else:
+        _keep_snapshot_warm()
+        context.update({
+            'books': data['books'],
+            'total': data['total'],
+            'available_count': data['available'],
+            'genre_facets': [dict(f, url=_querystring(request, genre=f['value'])) for f in data['genres']],
+            'author_facets': [dict(f, url=_querystring(request, author=f['value'])) for f in data['authors']],
+            'clear_genre_url': _querystring(request, genre=None),
+            'clear_author_url': _querystring(request, author=None),
+            'toggle_available_url': _querystring(request, available=None if available else '1'),
+        })
+
+    total = context['total']
+    if page > 1:
+        context['prev_url'] = _querystring(request, page=page - 1)
+    if page * size < total:
+        context['next_url'] = _querystring(request, page=page + 1)
+    context['page'] = page
+    return render(request, 'library/home.html', context)
+
 
+def autocomplete(request):
+    """Return title/author suggestions for the `q` prefix as JSON.
+
+    Served from the in-process prefix index (`library.typeahead`), most
+    borrowed books first. `limit` defaults to 10 and is capped at
+    `typeahead.MAX_RESULTS`.
+    """
+    q = request.GET.get('q', '')
     try:
-        books = mongo_models.Book.objects.all()
-    except PyMongoError as e:
-        # MongoDB operation failed at request time (e.g. auth revoked mid-run).
-        # Render the page with an empty list and present the error to the
-        # template so the UI stays friendly instead of raising a template
-        # iteration error while trying to evaluate the queryset.
-        return render(request, 'library/home.html', {'books': [], 'mongo_error': str(e)})
-    except Exception as e:
-        # Catch-all for other mongoengine/pymongo related runtime errors.
-        return render(request, 'library/home.html', {'books': [], 'mongo_error': str(e)})
-    return render(request, 'library/home.html', {'books': books})
+        limit = max(1, min(int(request.GET.get('limit', 10)), typeahead.MAX_RESULTS))
+    except ValueError:
+        limit = 10
+    results = [
+        {'id': book_id, 'title': title, 'author': author}
+        for book_id, title, author in typeahead.suggest(q, limit)
+    ]
+    return JsonResponse({'results': results})
+
+
+async def availability_stream(request):
+    """Stream availability changes as server-sent events.
+
+    `?books=` lists the ids (comma-separated) shown on the page. The
+    connection subscribes before it reads their current counts, which the
+    first event carries, so a change made between render and connect is in
+    either that event or a later one; later events carry only books that
+    changed, and
+    a comment every `LIVE_UPDATES_HEARTBEAT` seconds keeps proxies from
+    closing an idle stream. Needs the ASGI server (`library_project.asgi`):
+    under WSGI each stream would pin a worker, so the view answers 204,
+    which tells `EventSource` not to reconnect.
+    """
+    ids = live.parse_ids(request.GET.get('books', ''))
+    if not isinstance(request, ASGIRequest) or not ids:
+        return HttpResponse(status=204)
+
+    subscription = live.subscribe(ids)
+    initial = {}
+    connected, _ = mongo_status.get_status()
+    if connected:
+        try:
+            initial = await sync_to_async(live.availability)(ids)
+        except PyMongoError:
+            pass
+        except BaseException:
+            live.unsubscribe(subscription)
+            raise
+
+    async def events():
+        try:
+            yield 'retry: 5000\n\n' + live.format_event(initial)
+            while True:
+                changes = await subscription.next(live.heartbeat())
+                yield live.format_event(changes) if changes else ': keep-alive\n\n'
+        finally:
+            live.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def register_view(request):
@@ -97,32 +263,77 @@ def book_detail(request, pk):
     """Show details for a single book and borrowing state.
 
     The template receives flags indicating whether copies are available
-    and whether the current user has already borrowed this book.
+    and whether the current user has already borrowed this book, plus the
+    user's open reservation (and queue position) when there is one. A
+    user whose reservation is on hold may borrow even when no copy is free.
     """
     # pk is the MongoEngine id (as string). Try to fetch the document or 404.
     connected, mongo_err = mongo_status.get_status()
     if not connected:
-        # Database not available — present a 404 so templates don't error out.
-        raise Http404('Book data not available (MongoDB not connected)')
+        return _stale_book_detail(request, pk, mongo_err)
 
     try:
         book = mongo_models.Book.objects.get(id=pk)
+    except PyMongoError as e:
+        mongo_status.record_failure(e)
+        return _stale_book_detail(request, pk, str(e))
     except Exception:
         raise Http404('Book not found')
 
     can_borrow = book.available_copies > 0
     already_borrowed = False
+    reservation = None
+    queue_position = None
     if request.user.is_authenticated:
         already_borrowed = mongo_models.BorrowRecord.objects(user_id=request.user.id, book_id=book.id, returned=False).count() > 0
-    return render(request, 'library/book_detail.html', {'book': book, 'can_borrow': can_borrow, 'already_borrowed': already_borrowed})
+        reservation = mongo_models.Reservation.objects(user_id=request.user.id, book_id=book.id, active=True).first()
+        if reservation is not None:
+            if reservation.is_hold_active:
+                can_borrow = True
+            else:
+                queue_position = reservations.queue_position(reservation)
+    try:
+        also_borrowed = recommendations.for_book(book.id)
+    except Exception:
+        # recommendations are optional; never fail the page over them
+        also_borrowed = []
+    return render(request, 'library/book_detail.html', {
+        'book': book,
+        'can_borrow': can_borrow,
+        'already_borrowed': already_borrowed,
+        'reservation': reservation,
+        'queue_position': queue_position,
+        'also_borrowed': also_borrowed,
+    })
+
+
+def _stale_book_detail(request, pk, mongo_err):
+    """Render a book from the catalog snapshot while MongoDB is unavailable.
+
+    Borrowing is disabled; a 404 is raised only if the snapshot does not
+    know the book either.
+    """
+    book, snapshot_at = catalog_snapshot.load_book(pk)
+    if book is None:
+        raise Http404('Book data not available (MongoDB not connected)')
+    return render(request, 'library/book_detail.html', {
+        'book': book,
+        'can_borrow': False,
+        'already_borrowed': False,
+        'stale': True,
+        'snapshot_at': snapshot_at,
+        'mongo_error': mongo_err,
+    })
 
 
 @login_required
 def borrow_book(request, pk):
     """Create a BorrowRecord if a copy is available.
 
-    Prevents duplicate active borrows for the same user and book. On
-    success, redirects the user to their borrows page.
+    Prevents duplicate active borrows for the same user and book. The copy
+    is claimed atomically on the book (`reservations.claim_copy`), using
+    the user's hold when they have one. On success, redirects the user to
+    their borrows page.
     """
     connected, mongo_err = mongo_status.get_status()
     if not connected:
@@ -139,12 +350,26 @@ def borrow_book(request, pk):
     if mongo_models.BorrowRecord.objects(user_id=request.user.id, book_id=book.id, returned=False).count() > 0:
         messages.error(request, 'You have already borrowed this book.')
         return redirect('library:book_detail', pk=pk)
-    if book.available_copies <= 0:
-        messages.error(request, 'No copies available to borrow.')
+    if reservations.claim_copy(book.id, request.user.id) is None:
+        messages.error(request, 'No copies available to borrow. You can reserve the book instead.')
         return redirect('library:book_detail', pk=pk)
 
-    br = mongo_models.BorrowRecord(user_id=request.user.id, username=request.user.username, book_id=book.id, book_title=book.title)
-    br.save()
+    now = timezone.now()
+    br = mongo_models.BorrowRecord(
+        user_id=request.user.id,
+        username=request.user.username,
+        book_id=book.id,
+        book_title=book.title,
+        borrow_date=now,
+        due_date=overdue.due_date_for(now),
+    )
+    try:
+        br.save()
+    except Exception:
+        reservations.unclaim_copy(book.id)
+        raise
+    facets.availability_changed([book.id])
+    live.publish([book.id])
     messages.success(request, f'Borrowed "{book.title}"')
     return redirect('library:my_borrows')
 
@@ -155,7 +380,8 @@ def return_book(request, pk):
 
     Staff users can mark any record returned; regular users can only
     return their own records. The view updates the `returned` flag and
-    sets `return_date` when performing the return.
+    sets `return_date` when performing the return. The copy goes to the
+    next waiting reservation, if any (`reservations.release_copies`).
     """
     # Allow staff to return any borrow record; regular users can only return their own
     connected, mongo_err = mongo_status.get_status()
@@ -173,12 +399,15 @@ def return_book(request, pk):
         messages.error(request, 'You are not allowed to return this record.')
         return redirect('library:my_borrows')
 
-    if borrow.returned:
+    # conditional update, so a concurrent return frees the copy only once
+    if not mongo_models.BorrowRecord.objects(id=borrow.id, returned=False).update_one(
+        set__returned=True, set__return_date=timezone.now(),
+    ):
         messages.info(request, 'Already returned')
     else:
-        borrow.returned = True
-        borrow.return_date = timezone.now()
-        borrow.save()
+        reservations.release_copies(borrow.book_id)
+        facets.availability_changed([borrow.book_id])
+        live.publish([borrow.book_id])
         messages.success(request, f'Returned "{borrow.book_title}"')
     return redirect('library:my_borrows')
 
@@ -188,8 +417,11 @@ def my_borrows(request):
     """Display borrow records.
 
     - For staff users: group and display all active borrows (returned=False)
-      for every user so staff can manage them centrally.
-    - For regular users: show only the current user's active borrows.
+      for every user so staff can manage them centrally. `?overdue=1`
+      narrows the list to loans past their due date, served by the
+      `(returned, due_date)` index.
+    - For regular users: show only the current user's active borrows and
+      open reservations.
     """
     # Staff users see all users and their current borrows.
     if request.user.is_staff:
@@ -198,14 +430,18 @@ def my_borrows(request):
             # show empty view with error
             return render(request, 'library/my_borrows.html', {'user_borrows': {}, 'is_staff': True, 'mongo_error': mongo_err})
 
-        qs = mongo_models.BorrowRecord.objects(returned=False).order_by('+user_id', '-borrow_date')
+        overdue_only = request.GET.get('overdue') == '1'
+        qs = mongo_models.BorrowRecord.objects(returned=False)
+        if overdue_only:
+            qs = qs.filter(due_date__lt=timezone.now())
+        records = list(qs.order_by('+user_id', '-borrow_date'))
         user_borrows = {}
-        user_ids = set(r.user_id for r in qs)
+        user_ids = set(r.user_id for r in records)
         users = {u.id: u for u in User.objects.filter(id__in=list(user_ids))}
-        for r in qs:
+        for r in records:
             user_obj = users.get(r.user_id)
             user_borrows.setdefault(user_obj, []).append(r)
-        return render(request, 'library/my_borrows.html', {'user_borrows': user_borrows, 'is_staff': True})
+        return render(request, 'library/my_borrows.html', {'user_borrows': user_borrows, 'is_staff': True, 'overdue_only': overdue_only})
 
     connected, mongo_err = mongo_status.get_status()
     if not connected:
@@ -213,7 +449,61 @@ def my_borrows(request):
         return render(request, 'library/my_borrows.html', {'records': [], 'is_staff': False, 'mongo_error': mongo_err})
 
     records = mongo_models.BorrowRecord.objects(user_id=request.user.id, returned=False).order_by('-borrow_date')
-    return render(request, 'library/my_borrows.html', {'records': records, 'is_staff': False})
+    open_reservations = list(mongo_models.Reservation.objects(user_id=request.user.id, active=True).order_by('created_at'))
+    for r in open_reservations:
+        r.position = reservations.queue_position(r) if r.status == reservations.WAITING else None
+    return render(request, 'library/my_borrows.html', {'records': records, 'reservations': open_reservations, 'is_staff': False})
+
+
+@login_required
+@require_POST
+def reserve_book(request, pk):
+    """Join the waitlist for a book with no free copy.
+
+    Copies are handed out in reservation order as they come back; the user
+    is emailed when one is on hold for them.
+    """
+    connected, mongo_err = mongo_status.get_status()
+    if not connected:
+        messages.error(request, f'Cannot reserve: {mongo_err}')
+        return redirect('library:book_detail', pk=pk)
+
+    try:
+        book = mongo_models.Book.objects.get(id=pk)
+    except Exception:
+        messages.error(request, 'Book not found')
+        return redirect('library:home')
+
+    if mongo_models.BorrowRecord.objects(user_id=request.user.id, book_id=book.id, returned=False).count() > 0:
+        messages.error(request, 'You have already borrowed this book.')
+        return redirect('library:book_detail', pk=pk)
+    reservation = reservations.reserve(book, request.user)
+    if reservation is None:
+        messages.info(request, 'You have already reserved this book.')
+    else:
+        facets.availability_changed([book.id])
+        live.publish([book.id])
+        messages.success(request, f'Reserved "{book.title}"')
+    return redirect('library:book_detail', pk=pk)
+
+
+@login_required
+@require_POST
+def cancel_reservation(request, pk):
+    """Cancel one of the user's open reservations, passing on a held copy."""
+    connected, mongo_err = mongo_status.get_status()
+    if not connected:
+        messages.error(request, f'Cannot cancel: {mongo_err}')
+        return redirect('library:my_borrows')
+
+    book_id = reservations.cancel(pk, request.user.id)
+    if book_id is not None:
+        facets.availability_changed([book_id])
+        live.publish([book_id])
+        messages.success(request, 'Reservation cancelled')
+    else:
+        messages.info(request, 'Reservation not found or already closed')
+    return redirect('library:my_borrows')
 
 
 def staff_check(user):
@@ -221,6 +511,28 @@ def staff_check(user):
     return user.is_staff
 
 
+@login_required
+@user_passes_test(staff_check)
+@require_POST
+def bulk_return(request):
+    """Mark every selected loan returned in a single request (staff-only)."""
+    connected, mongo_err = mongo_status.get_status()
+    if not connected:
+        messages.error(request, f'Cannot return: {mongo_err}')
+        return redirect('library:my_borrows')
+
+    ids = request.POST.getlist('ids')
+    if not ids:
+        messages.info(request, 'No loans selected')
+        return redirect('library:my_borrows')
+    result = bulk.return_records(ids, user=request.user)
+    facets.availability_changed(result['book_ids'])
+    live.publish(result['book_ids'])
+    skipped = len(ids) - result['returned']
+    messages.success(request, f"Returned {result['returned']} of {len(ids)} selected loans" + (f' ({skipped} already returned)' if skipped else ''))
+    return redirect('library:my_borrows')
+
+
 @login_required
 @user_passes_test(staff_check)
 def admin_book_list(request):
@@ -234,7 +546,38 @@ def admin_book_list(request):
         return render(request, 'library/admin_book_list.html', {'books': [], 'mongo_error': mongo_err})
 
     books = mongo_models.Book.objects.all()
-    return render(request, 'library/admin_book_list.html', {'books': books})
+    return render(request, 'library/admin_book_list.html', {'books': books, 'bulk_form': BulkBookForm()})
+
+
+@login_required
+@user_passes_test(staff_check)
+@require_POST
+def admin_bulk_update_books(request):
+    """Apply a genre change and/or copy adjustment to the selected books."""
+    connected, mongo_err = mongo_status.get_status()
+    if not connected:
+        messages.error(request, f'Bulk update unavailable: {mongo_err}')
+        return redirect('library:admin_book_list')
+
+    ids = request.POST.getlist('ids')
+    form = BulkBookForm(request.POST)
+    if not ids:
+        messages.info(request, 'No books selected')
+    elif not form.is_valid():
+        for error in form.non_field_errors() or [e for errs in form.errors.values() for e in errs]:
+            messages.error(request, error)
+    else:
+        result = bulk.update_books(
+            ids,
+            genre=form.cleaned_data['genre'] or None,
+            copies_delta=form.cleaned_data['copies_delta'] or 0,
+        )
+        facets.invalidate()
+        live.publish(ids)
+        messages.success(request, f"Updated {result['updated']} of {len(ids)} selected books")
+        if result['skipped']:
+            messages.warning(request, f"Skipped {result['skipped']} books: the change would leave fewer copies than are on loan or on hold")
+    return redirect('library:admin_book_list')
 
 
 @login_required
@@ -280,14 +623,28 @@ def admin_edit_book(request, pk):
 @login_required
 @user_passes_test(staff_check)
 def admin_delete_book(request, pk):
-    """Delete a book after confirmation. Staff-only action."""
+    """Delete a book after confirmation. Staff-only action.
+
+    The book's borrow records are kept for history but flagged
+    `book_deleted` with their title frozen, in one bulk update; its open
+    reservations are cancelled with another.
+    """
     try:
         book = mongo_models.Book.objects.get(id=pk)
     except Exception:
         raise Http404('Book not found')
 
+    records = mongo_models.BorrowRecord.objects(book_id=book.id)
     if request.method == 'POST':
+        records.update(set__book_deleted=True, set__book_title=book.title)
+        reservations.cancel_for_book(book.id)
         book.delete()
+        typeahead.remove_book(pk)
+        facets.invalidate()
+        # best effort and last: MongoDB already changed, so a locked or
+        # unwritable snapshot must not turn the delete into an error
+        catalog_snapshot.forget_book(pk)
         messages.success(request, 'Book deleted')
         return redirect('library:admin_book_list')
-    return render(request, 'library/confirm_delete.html', {'object': book})
+    active = records.filter(returned=False).count()
+    return render(request, 'library/confirm_delete.html', {'object': book, 'active_borrows': active})
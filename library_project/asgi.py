@@ -0,0 +1,24 @@
+"""ASGI config for running the Django application.
+
+This module exposes the ASGI callable `application` used by ASGI servers
+(e.g. `gunicorn -k uvicorn.workers.UvicornWorker`). Regular views run as
+under WSGI; the live availability stream (`views.availability_stream`) is
+async, so idle open pages hold no worker thread.
+"""
+
+import os
+from django.core.asgi import get_asgi_application
+
+# Ensure the DJANGO_SETTINGS_MODULE environment variable points to the
+# project's settings module before creating the ASGI application.
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_project.settings')
+
+# The ASGI application callable used by ASGI servers.
+application = get_asgi_application()
+
+# Open this host's autocomplete index file (building it if no worker has
+# yet) in the background so it is ready by the time the first suggestions
+# are requested.
+from library import typeahead  # noqa: E402
+
+typeahead.warm_in_background()
@@ -31,6 +31,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Rate limits and concurrency caps; needs request.user (see ADMISSION_CONTROL)
+    'library.middleware.AdmissionControlMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,6 +56,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'library_project.wsgi.application'
+ASGI_APPLICATION = 'library_project.asgi.application'
 
 DATABASES = {
     # Use DATABASE_URL env var when available (Render/Postgres), otherwise fall back to local sqlite file
@@ -86,7 +89,15 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
+# collectstatic fingerprints every file (manifest) and writes gzip and,
+# with the Brotli package installed, brotli copies next to it. WhiteNoise
+# serves fingerprinted files with a far-future `immutable` Cache-Control.
+# The app's own CSS/JS are bundled from assets/ by `manage.py build_assets`.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
+ASSETS_SOURCE_DIR = BASE_DIR / 'assets'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -114,12 +125,21 @@ try:
 
     MONGODB_URI = get_mongodb_uri()
 
+    # Fail fast when MongoDB is unreachable or stalls so pages can fall back
+    # to the catalog snapshot instead of waiting out pymongo's 30 s default.
+    # Long batch commands can raise MONGODB_SOCKET_TIMEOUT_MS (0 = none).
+    MONGODB_TIMEOUTS = {
+        'serverSelectionTimeoutMS': int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '2000')),
+        'connectTimeoutMS': int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', '2000')),
+        'socketTimeoutMS': int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', '10000')) or None,
+    }
+
     try:
         if MONGODB_URI:
-            connect(host=MONGODB_URI)
+            connect(host=MONGODB_URI, **MONGODB_TIMEOUTS)
         else:
             # default local database name: library
-            connect('library', host='mongodb://localhost:27017/library')
+            connect('library', host='mongodb://localhost:27017/library', **MONGODB_TIMEOUTS)
 
         # Perform a lightweight verification call so authentication errors
         # surface at startup (MongoClient is lazy about some checks).
@@ -145,3 +165,78 @@ except Exception:
     # If mongoengine isn't installed at all, we still want the server to run.
     MONGO_CONNECTED = False
     MONGO_CONNECT_ERROR = 'mongoengine not installed'
+
+# On-disk catalog snapshot served while MongoDB is unreachable (see
+# library/catalog_snapshot.py). The snapshot is revalidated in the
+# background once it is older than MAX_AGE seconds.
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH', str(BASE_DIR / 'catalog_snapshot.sqlite3'))
+CATALOG_SNAPSHOT_MAX_AGE = int(os.environ.get('CATALOG_SNAPSHOT_MAX_AGE', '30'))
+
+# Co-borrowing recommendations (see library/recommendations.py). The
+# sparse matrix state used for incremental updates lives in STATE_DIR.
+RECOMMENDATIONS_STATE_DIR = os.environ.get('RECOMMENDATIONS_STATE_DIR', str(BASE_DIR / 'recommendations'))
+RECOMMENDATIONS_TOP_K = int(os.environ.get('RECOMMENDATIONS_TOP_K', '10'))
+
+# Seconds between incremental syncs of the autocomplete index with edits
+# made by other worker processes (see library/typeahead.py).
+TYPEAHEAD_SYNC_INTERVAL = int(os.environ.get('TYPEAHEAD_SYNC_INTERVAL', '60'))
+# The autocomplete index file shared by every worker on the host, and the
+# age in seconds after which a worker rebuilds it.
+TYPEAHEAD_INDEX_PATH = os.environ.get('TYPEAHEAD_INDEX_PATH', str(BASE_DIR / 'typeahead.idx'))
+TYPEAHEAD_INDEX_MAX_AGE = int(os.environ.get('TYPEAHEAD_INDEX_MAX_AGE', '86400'))
+
+# Shared cache for catalog facets and, with ADMISSION_BACKEND=cache,
+# admission control. Set CACHE_URL to a Redis URL (e.g.
+# redis://localhost:6379/1) so every worker sees facet invalidations at
+# once; empty keeps Django's per-process memory cache.
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        },
+    }
+
+# Catalog paging and facet caching (see library/facets.py). Facet results
+# are cached in the default cache (see CACHE_URL above).
+CATALOG_PAGE_SIZE = int(os.environ.get('CATALOG_PAGE_SIZE', '60'))
+CATALOG_FACETS_TTL = int(os.environ.get('CATALOG_FACETS_TTL', '300'))
+
+# Loan period applied to new borrows and used by the overdue sweep
+# (see library/overdue.py).
+LOAN_PERIOD_DAYS = int(os.environ.get('LOAN_PERIOD_DAYS', '14'))
+
+# Overdue notifications are emailed by `manage.py drain_notifications`.
+# Defaults to printing emails to the console until SMTP is configured.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'library@localhost')
+
+# Admission control (see library/middleware.py for all keys and defaults).
+# Set ADMISSION_BACKEND=cache and CACHE_URL to make limits hold across
+# gunicorn workers.
+ADMISSION_CONTROL = {
+    'ENABLED': str(os.environ.get('ADMISSION_CONTROL', 'true')).lower() in ('1', 'true', 'yes'),
+    'BACKEND': os.environ.get('ADMISSION_BACKEND', 'local'),
+    'TRUST_X_FORWARDED_FOR': str(os.environ.get('TRUST_X_FORWARDED_FOR', 'false')).lower() in ('1', 'true', 'yes'),
+    # proxies that append to X-Forwarded-For in front of the app
+    'TRUSTED_PROXY_COUNT': int(os.environ.get('TRUSTED_PROXY_COUNT', '1')),
+}
+
+# Hours a returned copy stays on hold for the next reader on the waitlist
+# before `manage.py reservation_sweep` passes it on (see
+# library/reservations.py).
+RESERVATION_HOLD_HOURS = int(os.environ.get('RESERVATION_HOLD_HOURS', '48'))
+
+# Live availability updates (see library/live.py) stream over server-sent
+# events and need the ASGI server. Set LIVE_UPDATES_BROKER_URL to a Redis
+# URL (requires the `redis` package) to fan updates out across workers;
+# empty keeps them within each process.
+LIVE_UPDATES_BROKER_URL = os.environ.get('LIVE_UPDATES_BROKER_URL', '')
+LIVE_UPDATES_HEARTBEAT = int(os.environ.get('LIVE_UPDATES_HEARTBEAT', '15'))
+LIVE_UPDATES_MAX_BOOKS = int(os.environ.get('LIVE_UPDATES_MAX_BOOKS', '200'))
+
+# After a MongoDB operation fails at request time, pages are served from
+# the catalog snapshot for this many seconds before MongoDB is tried again
+# (see library/mongo_status.py).
+MONGODB_BREAKER_SECONDS = int(os.environ.get('MONGODB_BREAKER_SECONDS', '30'))
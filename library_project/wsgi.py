@@ -14,3 +14,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_project.settings')
 
 # The WSGI application callable used by WSGI servers.
 application = get_wsgi_application()
+
+# Open this host's autocomplete index file (building it if no worker has
+# yet) in the background so it is ready by the time the first suggestions
+# are requested.
+from library import typeahead  # noqa: E402
+
+typeahead.warm_in_background()
@@ -0,0 +1,6 @@
+(function(){var input=document.getElementById('book-search');var box=document.getElementById('book-suggestions');if(!input||!box){return;}
+var pending=null;input.addEventListener('input',function(){var q=input.value.trim();if(pending){pending.abort();}
+if(!q){box.innerHTML='';return;}
+pending=new AbortController();fetch(input.dataset.url+'?q='+encodeURIComponent(q),{signal:pending.signal}).then(function(r){return r.json();}).then(function(data){box.innerHTML='';data.results.forEach(function(b){var a=document.createElement('a');a.className='list-group-item list-group-item-action';a.href=input.dataset.detailUrl.replace('BOOK_ID',b.id);a.textContent=b.title+' — '+b.author;box.appendChild(a);});}).catch(function(){});});})();;(function(){var url=document.body.dataset.liveUrl;var nodes=document.querySelectorAll('[data-live-book]');if(!url||!nodes.length||!window.EventSource){return;}
+var ids=[];nodes.forEach(function(n){if(ids.indexOf(n.dataset.liveBook)<0){ids.push(n.dataset.liveBook);}});var source=new EventSource(url+'?books='+ids.join(','));source.addEventListener('availability',function(e){var changes=JSON.parse(e.data);nodes.forEach(function(n){var c=changes[n.dataset.liveBook];if(!c){return;}
+n.querySelector('.live-available').textContent=c.available;n.querySelector('.live-total').textContent=c.total;});});})();
\ No newline at end of file